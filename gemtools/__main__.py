@@ -12,27 +12,9 @@ Usage:
 import os
 import sys
 import argparse
+import importlib
 
 from gemtools import __version__
-from gemtools.set_bc_window_f import set_bc_window
-from gemtools.get_shared_bcs_f import get_shared_bcs
-from gemtools.set_hap_window_f import set_hap_window
-from gemtools.assign_sv_haps_f import assign_sv_haps
-from gemtools.count_bcs_f import count_bcs
-from gemtools.plot_hmw_f import plot_hmw
-from gemtools.get_phased_basic_f import get_phased_basic
-from gemtools.get_phase_blocks_f import get_phase_blocks
-from gemtools.get_bcs_in_region_f import get_bcs_in_region
-from gemtools.get_phased_bcs_f import get_phased_bcs
-from gemtools.count_bcs_list_f import count_bcs_list
-from gemtools.extract_reads_interleaved_f import extract_reads_interleaved
-from gemtools.extract_reads_f import extract_reads
-from gemtools.plot_vars_and_blocks_f import plot_vars_and_blocks
-from gemtools.plot_haps_and_blocks_f import plot_haps_and_blocks
-
-from gemtools.get_hmw_summary_f import get_hmw_summary
-from gemtools.align_contigs_f import align_contigs
-from gemtools.assess_contigs_f import assess_contigs
 
 def gt_usage_msg(name=None):                                                            
     return '''\tgemtools -T <sub-tool> [options]
@@ -44,17 +26,20 @@ usage:	gemtools -T <sub-tool> [options]\n
 The gemtools sub-tools include:\n 
 [ Phase analysis tools ] 
     get_phased_basic   Obtain phasing information for all SNVs in the vcf file. 
-    get_phase_blocks   Summarize phase blocks -- coordinates, size, SNVs per phase block etc.\n
+    get_phase_blocks   Summarize phase blocks -- coordinates, size, SNVs per phase block etc.
+    index_phased_bcs   Index the phase block and haplotype supported by every barcode in the vcf file.\n
 [ SV analysis tools ]
     set_bc_window	Generate windows around SV breakpoints for SV analysis.
     get_shared_bcs	Determine barcodes shared between SV breakpoints.
     set_hap_window	Generate windows around SV breakpoints for haplotype analysis.
     assign_sv_haps	Assign SV barcodes to existing haplotypes (SNVs).
     count_bcs		Determine presence and quantity of given barcodes across a given region surrounding the SV breakpoints.
-    plot_hmw		Generate a plot of the mapping locations of reads with each barcode. \n
+    plot_hmw		Generate a plot of the mapping locations of reads with each barcode.
+    get_hmw_summary	Summarize the barcodes (HMW molecules) that span both breakpoints of each SV. \n
 [ Subset reads by barcode ]
     extract_reads		Obtain reads with particular barcodes from Long Ranger fastq files (R1,R2,I1).
-    extract_reads_interleaved	Obtain reads with particular barcodes from (older version of) Long Ranger fastq files (RA,I1). \n
+    extract_reads_interleaved	Obtain reads with particular barcodes from (older version of) Long Ranger fastq files (RA,I1).
+    extract_reads_bam	Obtain read pairs with particular barcodes from a Long Ranger bam file, using a barcode index of the bam. \n
 [ General tools ]
     get_phased_bcs	For a particular phase block, return the haplotype 1 and haplotype 2 barcodes.
     get_bcs_in_region	Get all the barcodes that exist in a given region of the genome.
@@ -62,6 +47,7 @@ The gemtools sub-tools include:\n
     plot_hmw		Generate a plot of the mapping locations of reads with each barcode (SAME AS ABOVE).
     plot_vars_and_blocks	For a particular region, plot the heterozygous variants and phase blocks. 
     plot_haps_and_blocks	For a particular region, plot the haplotypes and phase blocks. 
+    haplotag		Tag the reads in a bam file with the haplotype (HP) and phase block (PS) of their barcode.
         """
 # from SV analysis tools
 #    align_contigs	Align de novo assembled contigs to a genome reference (using mappy/minimap2).
@@ -157,13 +143,56 @@ def get_option_parser():
 		help="File of genome reference")
 	parser.add_argument("--sort",
 		dest="sort", help="Sort the barcodes by start coordinate", action="store_true")
+	parser.add_argument("--long",
+		dest="long", help="Write barcode counts in long format: one row per window and barcode with reads", action="store_true")
+	parser.add_argument("--backend", metavar='(auto|R|matplotlib)',
+		choices=('auto','R','matplotlib'), default='auto',
+		dest="backend",
+		help="Plot rendering backend: R (ggplot2 via rpy2) or matplotlib; auto uses R if available")
+	parser.add_argument("--raster", action='store_true',
+		dest="raster",
+		help="Draw the plot points as an image binned to the plot's pixels")
+	parser.add_argument("--max_bcs", type=int, default=None,
+		dest="max_bcs",metavar="MAX_BCS",
+		help="Plot at most this many barcodes")
 	parser.add_argument("--preset",
 		dest="preset", metavar="PRESET",
 		help="Preset for minimap2")
+	parser.add_argument("--index_dir",
+		dest="index_dir", metavar="DIR",
+		help="Directory of cached minimap2 indexes                       "
+			"default: ~/.gemtools/mmi")
+	parser.add_argument("--assess",
+		dest="assess_out", metavar="FILE",
+		help="Also write the assessment of the contigs (as assess_contigs) to this file")
 	parser.add_argument("-t","--nthreads", type=int, default=3,
 		dest="nthreads",metavar="THREADS",
-		help="Number of threads to use for minimap2 alignment                       "
+		help="Number of threads to use for minimap2 alignment / bam compression                       "
 			"default: 3")
+	parser.add_argument("--compress_level", type=int, default=6, choices=range(0,10),
+		dest="compress_level",metavar="LEVEL",
+		help="Compression level of output fastq files; 0 writes uncompressed fastq                       "
+			"default: 6")
+	parser.add_argument("--stdout",
+		dest="stdout", help="Stream extracted reads (interleaved, uncompressed) to stdout", action="store_true")
+	parser.add_argument("--bc_correct",
+		dest="bc_correct", help="Also match reads whose barcode is one mismatch away from a requested barcode", action="store_true")
+	parser.add_argument("--resume",
+		dest="resume", help="Continue an interrupted extraction from its last checkpoint", action="store_true")
+	parser.add_argument("--manifest",
+		dest="manifest", metavar="MANIFEST",
+		help="Named barcode sets to demultiplex reads into, or the plots to render in batch mode")
+	parser.add_argument("--max_open", type=int, default=100,
+		dest="max_open",metavar="MAX_OPEN",
+		help="Maximum number of output files open at once                       "
+			"default: 100")
+	parser.add_argument("--nprocs", type=int, default=1,
+		dest="nprocs",metavar="PROCS",
+		help="Number of processes to use for region sharding                       "
+			"default: 1")
+	parser.add_argument("--bed",
+		dest="bed", metavar="BED",
+		help="BED file of regions; one plot per region")
 	parser.add_argument("--basic",
 		dest="basic_in", metavar="BASIC",
 		help="phased basic file")
@@ -177,42 +206,41 @@ def get_option_parser():
 
 	return parser
 
+## SUB-TOOL REGISTRY
+## tool -> (module, function, keyword arguments of the function built from the parsed args)
+## a tool's module is only imported when the tool is run, so the cost of starting gemtools is that of the
+## selected tool's dependencies (e.g. set_bc_window does not load pysam, rpy2 or mappy)
+TOOLS = {
+	"set_hap_window": ("gemtools.set_hap_window_f", "set_hap_window", lambda args: dict(bedpe=args.infile, window=args.window_size, out=args.outfile)),
+	"get_shared_bcs": ("gemtools.get_shared_bcs_f", "get_shared_bcs", lambda args: dict(bed_in=args.infile, bam=args.bam, out=args.outfile, map_qual=args.mapqual)),
+	"assign_sv_haps": ("gemtools.assign_sv_haps_f", "assign_sv_haps", lambda args: dict(sv=args.infile, window=args.window_size, vcf_control=args.vcf_control, vcf_test=args.vcf, out=args.outfile, shrd_file = args.shrd_file)),
+	"count_bcs": ("gemtools.count_bcs_f", "count_bcs", lambda args: dict(bam=args.bam, sv=args.infile, in_window=args.in_window, out_window=args.out_window, sv_name=args.sv_name, out=args.outfile, shrd_file = args.shrd_file, long=args.long)),
+	"get_phased_basic": ("gemtools.get_phased_basic_f", "get_phased_basic", lambda args: dict(vcf=args.vcf, out=args.outfile, chrom=args.chrom)),
+	"get_phase_blocks": ("gemtools.get_phase_blocks_f", "get_phase_blocks", lambda args: dict(infile_basic=args.infile, out=args.outfile)),
+	"index_phased_bcs": ("gemtools.index_phased_bcs_f", "index_phased_bcs", lambda args: dict(vcf=args.vcf, out=args.outfile, chrom=args.chrom)),
+	"get_phased_bcs": ("gemtools.get_phased_bcs_f", "get_phased_bcs", lambda args: dict(infile_basic=args.infile, ps=args.phase_block, out=args.outfile)),
+	"count_bcs_list": ("gemtools.count_bcs_list_f", "count_bcs_list", lambda args: dict(region=args.region_in, in_window=args.in_window, bam=args.bam, bcs=args.bcs, out=args.outfile, long=args.long)),
+	"haplotag": ("gemtools.haplotag_f", "haplotag", lambda args: dict(bam=args.bam, bc_index=args.infile, vcf=args.vcf, out=args.outfile, nthreads=args.nthreads, nprocs=args.nprocs)),
+	"get_bcs_in_region": ("gemtools.get_bcs_in_region_f", "get_bcs_in_region", lambda args: dict(region=args.region_in,bam=args.bam, out=args.outfile)),
+	"get_hmw_summary": ("gemtools.get_hmw_summary_f", "get_hmw_summary", lambda args: dict(infile=args.infile, out=args.outfile)),
+	"plot_hmw": ("gemtools.plot_hmw_f", "plot_hmw", lambda args: dict(in_windows=args.infile, out=args.outfile, sort_by_coord=args.sort, backend=args.backend, manifest=args.manifest, nprocs=args.nprocs, raster=args.raster, max_bcs=args.max_bcs)),
+	"extract_reads_interleaved": ("gemtools.extract_reads_interleaved_f", "extract_reads_interleaved", lambda args: dict(fqdir=args.fqdir, s_bcs=args.s_bcs, lanes=args.lanes, bcs=args.bcs, fq_outdir=args.outdir, nthreads=args.nthreads, nprocs=args.nprocs, compress_level=args.compress_level, stdout=args.stdout, bc_correct=args.bc_correct)),
+	"extract_reads": ("gemtools.extract_reads_f", "extract_reads", lambda args: dict(bcs=args.bcs, fq_outdir=args.outdir, read1=args.read1, read2=args.read2, index1=args.index1, nthreads=args.nthreads, compress_level=args.compress_level, stdout=args.stdout, manifest=args.manifest, max_open=args.max_open, resume=args.resume, bc_correct=args.bc_correct)),
+	"extract_reads_bam": ("gemtools.extract_reads_bam_f", "extract_reads_bam", lambda args: dict(bam=args.bam, bcs=args.bcs, fq_outdir=args.outdir, bx_index=args.infile, nthreads=args.nthreads, compress_level=args.compress_level)),
+	"align_contigs": ("gemtools.align_contigs_f", "align_contigs", lambda args: dict(infile_fasta=args.infile, genome=args.ref_file, out=args.outfile, preset=args.preset, nthreads=args.nthreads, index_dir=args.index_dir, assess_out=args.assess_out)),
+	"assess_contigs": ("gemtools.assess_contigs_f", "assess_contigs", lambda args: dict(infile_aln=args.infile, out=args.outfile)),
+	"set_bc_window": ("gemtools.set_bc_window_f", "set_bc_window", lambda args: dict(bedpe=args.infile, window=args.window_size, out=args.outfile, mode=args.region_mode)),
+	"plot_vars_and_blocks": ("gemtools.plot_vars_and_blocks_f", "plot_vars_and_blocks", lambda args: dict(infile_basic=args.basic_in, infile_blocks=args.blocks_in, region=args.region_in, out=args.outfile, manifest=args.manifest, bed=args.bed, nprocs=args.nprocs)),
+	"plot_haps_and_blocks": ("gemtools.plot_haps_and_blocks_f", "plot_haps_and_blocks", lambda args: dict(infile_basic=args.basic_in, infile_blocks=args.blocks_in, region=args.region_in, out=args.outfile, manifest=args.manifest, bed=args.bed, nprocs=args.nprocs)),
+}
+
+def load_tool(tool):
+	(module_name, func_name, build_kwargs) = TOOLS[tool]
+	return getattr(importlib.import_module(module_name), func_name)
+
 def pipeline_from_parsed_args(args):
-	if args.tool=="set_hap_window":
-		pipeline = set_hap_window(bedpe=args.infile, window=args.window_size, out=args.outfile)
-	if args.tool=="get_shared_bcs":
-		pipeline = get_shared_bcs(bed_in=args.infile, bam=args.bam, out=args.outfile, map_qual=args.mapqual)
-	if args.tool=="assign_sv_haps":
-		pipeline = assign_sv_haps(sv=args.infile, window=args.window_size, vcf_control=args.vcf_control, vcf_test=args.vcf, out=args.outfile, shrd_file = args.shrd_file)
-	if args.tool=="count_bcs":
-		pipeline = count_bcs(bam=args.bam, sv=args.infile, in_window=args.in_window, out_window=args.out_window, sv_name=args.sv_name, out=args.outfile, shrd_file = args.shrd_file)
-	if args.tool=="get_phased_basic":
-		pipeline = get_phased_basic(vcf=args.vcf, out=args.outfile, chrom=args.chrom)
-	if args.tool=="get_phase_blocks":
-		pipeline = get_phase_blocks(infile_basic=args.infile, out=args.outfile)
-	if args.tool=="get_phased_bcs":
-		pipeline = get_phased_bcs(infile_basic=args.infile, ps=args.phase_block, out=args.outfile)
-	if args.tool=="count_bcs_list":
-		pipeline = count_bcs_list(region=args.region_in, in_window=args.in_window, bam=args.bam, bcs=args.bcs, out=args.outfile)
-	if args.tool=="get_bcs_in_region":
-		pipeline = get_bcs_in_region(region=args.region_in,bam=args.bam, out=args.outfile)
-	if args.tool=="plot_hmw":
-		pipeline = plot_hmw(in_windows=args.infile, out=args.outfile, sort_by_coord=args.sort)
-	if args.tool=="extract_reads_interleaved":
-		pipeline = extract_reads_interleaved(fqdir=args.fqdir, s_bcs=args.s_bcs, lanes=args.lanes, bcs=args.bcs, fq_outdir=args.outdir)
-	if args.tool=="extract_reads":
-		pipeline = extract_reads(bcs=args.bcs, fq_outdir=args.outdir, read1=args.read1, read2=args.read2, index1=args.index1)
-	if args.tool=="align_contigs":
-		pipeline = align_contigs(infile_fasta=args.infile, genome=args.ref_file, out=args.outfile, preset=args.preset, nthreads=args.nthreads)
-	if args.tool=="assess_contigs":
-		pipeline = assess_contigs(infile_aln=args.infile, out=args.outfile)
-	if args.tool=="set_bc_window":
-		pipeline = set_bc_window(bedpe=args.infile, window=args.window_size, out=args.outfile, mode=args.region_mode)
-	if args.tool=="plot_vars_and_blocks":
-		pipeline = plot_vars_and_blocks(infile_basic=args.basic_in, infile_blocks=args.blocks_in, region=args.region_in, out=args.outfile)
-	if args.tool=="plot_haps_and_blocks":
-		pipeline = plot_haps_and_blocks(infile_basic=args.basic_in, infile_blocks=args.blocks_in, region=args.region_in, out=args.outfile)
-		
+	build_kwargs = TOOLS[args.tool][2]
+	pipeline = load_tool(args.tool)(**build_kwargs(args))
 	return pipeline
 
 def main(cmdlineargs=None):
@@ -227,7 +255,7 @@ def main(cmdlineargs=None):
 			print gt_help_msg
 			sys.exit(1)
 
-	if args.tool not in ['get_phased_basic','get_phase_blocks','set_bc_window','get_shared_bcs','set_hap_window','assign_sv_haps','count_bcs','plot_hmw','extract_reads','extract_reads_interleaved','get_phased_bcs','get_bcs_in_region','count_bcs_list','plot_hmw','align_contigs','assess_contigs','plot_vars_and_blocks','plot_haps_and_blocks']:
+	if args.tool not in TOOLS:
 		print "Please provide a valid gemtools sub-tool.\n"
 		print gt_help_msg
 		sys.exit(1)
@@ -242,7 +270,7 @@ Usage:   gemtools -T get_phased_basic [OPTIONS] -v <LR.vcf.gz> -o <output.phased
 Input:
 	-v  gzipped vcf file output from Long Ranger
 Output:
-	-o  output file: each row is an SNV; columns are phasing information for each SNV
+	-o  output file: each row is an SNV; columns are phasing information for each SNV (if name ends in .gz: bgzip-compressed and tabix-indexed)
 Options:
 	-n  chromosome number (ex: 22 or chr22)
 			"""
@@ -263,7 +291,7 @@ Usage:   gemtools -T get_phase_blocks -i <output.phased_basic.txt> -o <output.ph
 Input:
 	-i  output from 'get_phased_basic' tool
 Output:
-	-o  output file: each row is a phase block, columns summarize information for each phase block (size etc.)
+	-o  output file: each row is a phase block, columns summarize information for each phase block (size etc.) (if name ends in .gz: bgzip-compressed and tabix-indexed; otherwise with an interval index of the blocks, <output>.bidx.npy)
 			"""
 			sys.exit(1)
 		if not (args.infile or args.outfile):
@@ -272,6 +300,27 @@ Output:
 		if not os.path.isfile(args.infile):
 			parser.error(str(args.infile) + " does not exist")
 
+##########################################################################################
+	if args.tool=="index_phased_bcs":
+		if args.help:
+			print """
+Tool:	gemtools -T index_phased_bcs
+Summary: Index the phase block and haplotype supported by every barcode in the vcf file\n
+Usage:   gemtools -T index_phased_bcs [OPTIONS] -v <LR.vcf.gz> -o <output_prefix>
+Input:
+	-v  gzipped vcf file output from Long Ranger
+Output:
+	-o  output prefix: <prefix>.bcs.txt, <prefix>.blocks.npy, <prefix>.offsets.npy and <prefix>.records.npy
+Options:
+	-n  chromosome number (ex: 22 or chr22)
+			"""
+			sys.exit(1)
+		if not (args.outfile or args.vcf):
+			parser.error('Missing required input')
+
+		if not str(args.vcf).endswith(".vcf.gz"):
+			parser.error(str(args.vcf) + " does not appear to be a gzipped vcf file")
+
 ##########################################################################################	
 	if args.tool=="get_phased_bcs":
 		if args.help:
@@ -326,6 +375,8 @@ Input:
 	-l  file containing list of barcodes (one barcode per line)
 Output:
 	-o  output file: barcode counts in windows 
+Options:
+	--long  long format output: one row per window and barcode with reads (chrom, window_start, window_end, barcode, count) instead of one column per barcode; written as the windows are counted
 			"""
 			sys.exit(1)		
 		if not (args.bam or args.region_in or args.outfile or args.bcs):
@@ -345,22 +396,54 @@ Output:
 Tool:	gemtools -T plot_hmw
 Summary: Generate a plot of the mapping locations of reads with each barcode\n
 Usage:   gemtools -T plot_hmw -i <out.bc_count.txt> -o <output.png>
+         gemtools -T plot_hmw --manifest <plots.txt> [--nprocs <procs>]
 Input:
-	-i  output file generated by 'count_bcs' or 'count_bcs_list' tool
+	-i  output file generated by 'count_bcs' or 'count_bcs_list' tool (either format)
 Output:
 	-o  output file: plot of barcode mapping locations in a given region (png file)
 Options:
 	--sort  sort the barcodes by mapping coordinate
+	--backend  plot rendering: 'R' (ggplot2 through rpy2), 'matplotlib' (no R needed, faster), or 'auto' -- R if rpy2 and R are available, matplotlib otherwise (default: auto)
+	--raster  draw the points as an image binned to the plot's pixels (matplotlib); for regions with many windows and barcodes
+	--max_bcs  plot at most this many barcodes, evenly spread over the plot rows
+	--manifest  batch mode, instead of -i/-o: tab-separated file with one plot per line (count file, output png)
+	--nprocs  number of processes rendering the plots of a batch (default: 1)
 			"""
 			sys.exit(1)		
-		if not (args.infile or args.outfile):
-			parser.error('Missing required input')
+		if args.manifest:
+			if not os.path.isfile(args.manifest):
+				parser.error(str(args.manifest) + " does not exist")
+		else:
+			if not (args.infile or args.outfile):
+				parser.error('Missing required input')
 		
+			if not os.path.isfile(args.infile):
+				parser.error(str(args.infile) + " does not exist")
+			if not str(args.outfile).endswith(".png"):
+				parser.error(str(args.outfile) + " : Output file must be a png file, ex: out.png")
+		if args.max_bcs is not None and args.max_bcs<1:
+			parser.error(str(args.max_bcs) + " : --max_bcs must be an integer >0")
+
+
+##########################################################################################
+	if args.tool=="get_hmw_summary":
+		if args.help:
+			print """
+Tool:	gemtools -T get_hmw_summary
+Summary: Summarize the barcodes (HMW molecules) that span both breakpoints of each SV\n
+Usage:   gemtools -T get_hmw_summary -i <out.bc_count.txt> -o <out.hmw_summary.txt>
+Input:
+	-i  output file generated by 'count_bcs' tool (either format)
+Output:
+	-o  output file: one row per barcode and SV, for the barcodes with reads around both breakpoints -- span, number of windows and reads at each breakpoint
+	    (the count table restricted to these barcodes is written to <output prefix>.bc_windows.subset.txt, in the format of the input)
+			"""
+			sys.exit(1)
+		if not (args.infile and args.outfile):
+			parser.error('Missing required input')
+
 		if not os.path.isfile(args.infile):
 			parser.error(str(args.infile) + " does not exist")
-		if not str(args.outfile).endswith(".png"):
-			parser.error(str(args.outfile) + " : Output file must be a png file, ex: out.png")
-
 
 ##########################################################################################
 	if args.tool=="set_bc_window":
@@ -476,6 +559,7 @@ Output:
 Options:
 	-x  size of small windows to check for barcodes (default: 1000 bp)
 	-y  size of large windows around breakpoints to check for barcodes (default: 100,000 bp)
+	--long  long format output: one row per window and barcode with reads (id, name, chrom, window_start, window_end, barcode, count) instead of one column per barcode; written as the windows are counted
 			"""
 			sys.exit(1)
 		if not (args.infile or args.outfile or args.sv_name or args.bam or args.shrd_file):
@@ -503,13 +587,30 @@ Input:
 	--read2  Long Ranger read 2 fastq file
 	--index1  Long Ranger index 1 fastq file
 Output:
-	--outdir  Output directory for output fastq files; subsetted R1, R2 and I1 files will be generated here
+	--outdir  Output directory for output fastq files; subsetted R1, R2 and I1 files will be generated here, along with bc_match_counts.txt (reads matched per barcode)
+	--stdout  Instead of writing to --outdir, stream matching R1/R2 records (interleaved, uncompressed) to stdout; if --outdir is also given, only bc_match_counts.txt is written there
+Demultiplexing (instead of --bc_list):
+	--manifest  named barcode sets: output of 'get_shared_bcs' (name, num_bcs, bcs), or a two-column table (set_name, barcode; no header); the library is read once and each read is written to <outdir>/<set_name>/ for every set containing its barcode, with set_match_counts.txt (reads per set) in --outdir
+	--max_open  maximum number of output files open at once; others are closed and reopened for appending as needed (default: 100)
+Options:
+	-t  number of decompression threads per input file, used if pigz is installed, and of output compression threads (default: 3)
+	--compress_level  compression level of the (BGZF) output fastq files, 1-9; 0 writes uncompressed .fastq files (default: 6)
+	--bc_correct  also match reads whose barcode has one mismatch (or N) relative to exactly one requested barcode; bc_match_counts.txt gets a corrected_reads column, and exact and corrected matches are reported separately
+	--resume  continue an interrupted run (same inputs, barcodes and --outdir) from its last checkpoint; a checkpoint (extract_reads.checkpoint.json in --outdir) is saved every 5 minutes and removed when the run completes
 			"""
 			sys.exit(1)		
 		if not (args.bcs or args.read1 or args.read2 or args.index1 or args.outdir):
 			parser.error('Missing required input')
-			
-		if not os.path.isfile(args.bcs):
+		if not (args.outdir or args.stdout):
+			parser.error('One of --outdir or --stdout is required')
+		if args.manifest:
+			if not os.path.isfile(args.manifest):
+				parser.error(str(args.manifest) + " does not exist")
+			if args.stdout or not args.outdir:
+				parser.error('--manifest requires --outdir (and cannot be used with --stdout)')
+		if args.resume and (args.stdout or args.manifest or not args.outdir):
+			parser.error('--resume requires --outdir (and cannot be used with --stdout or --manifest)')
+		if not args.manifest and not (args.bcs and os.path.isfile(args.bcs)):
 			parser.error(str(args.bcs) + " does not exist")
 
 ##########################################################################################
@@ -525,7 +626,13 @@ Input:
 	--sample_bcs  comma-separated list of Long Ranger sample barcodes
 	--sample_lanes  comma-separated list of seq lanes to consider
 Output:
-	--outdir  Output directory for output fastq files; subsetted RA and I1 files will be generated here
+	--outdir  Output directory for output fastq files; subsetted RA and I1 files will be generated here, along with bc_match_counts.txt (reads matched per barcode)
+	--stdout  Instead of writing to --outdir, stream matching RA records (uncompressed) to stdout; if --outdir is also given, only bc_match_counts.txt is written there
+Options:
+	-t  number of decompression threads per input file, used if pigz is installed, and of output compression threads (default: 3)
+	--compress_level  compression level of the (BGZF) output fastq files, 1-9; 0 writes uncompressed .fastq files (default: 6)
+	--bc_correct  also match reads whose barcode has one mismatch (or N) relative to exactly one requested barcode; bc_match_counts.txt gets a corrected_reads column, and exact and corrected matches are reported separately
+	--nprocs  number of (sample barcode, lane) file pairs to extract concurrently (default: 1)
 			"""
 			sys.exit(1)		
 		if not (args.fqdir or args.s_bcs or args.lanes or args.bcs or args.outdir):
@@ -533,23 +640,57 @@ Output:
 		
 		if not os.path.isfile(args.bcs):
 			parser.error(str(args.bcs) + " does not exist")
-		if os.path.isdir(args.outdir):
+		if not (args.outdir or args.stdout):
+			parser.error('One of --outdir or --stdout is required')
+		if args.outdir and os.path.isdir(args.outdir):
 			parser.error(str(args.outdir) + " already exists")
 
+##########################################################################################
+	if args.tool=="extract_reads_bam":
+		if args.help:
+			print """
+Tool:	gemtools -T extract_reads_bam
+Summary: Obtain read pairs with particular barcodes from a Long Ranger bam file\n
+Usage:   gemtools -T extract_reads_bam -b <LR.bam> --bc_list <bc_list.txt> --outdir <fastq_output_dir>
+Input:
+	-b  indexed bam file generated by Long Ranger
+	--bc_list  file containing list of barcodes (one barcode per line)
+Output:
+	--outdir  Output directory; <bam name>_R1.fastq.gz and <bam name>_R2.fastq.gz (reads as stored in the bam, with BX:Z:<barcode> in the read name line) are generated here, along with bc_match_counts.txt (read pairs matched per barcode)
+Options:
+	-i  prefix of the barcode index of the bam (default: the bam file name); the index (<prefix>.bx.*) is built on first use, and rebuilt if the bam is newer
+	-t  number of bam decompression and output compression threads (default: 3)
+	--compress_level  compression level of the (BGZF) output fastq files, 1-9; 0 writes uncompressed .fastq files (default: 6)
+			"""
+			sys.exit(1)
+		if not (args.bam and args.bcs and args.outdir):
+			parser.error('Missing required input')
+
+		if not str(args.bam).endswith(".bam"):
+			parser.error(str(args.bam) + " does not appear to be a bam file")
+		if not os.path.isfile(args.bcs):
+			parser.error(str(args.bcs) + " does not exist")
+
 ##########################################################################################	
 	if args.tool=="align_contigs":
 		if args.help:
 			print """
 Tool:	gemtools -T align_contigs
 Summary: Aligns contigs to the genome\n
-Usage:   gemtools -T align_contigs [OPTIONS] -i <de_novo.fasta.gz> -o <out.txt> -r <genome_reference_fasta>
+Usage:   gemtools -T align_contigs [OPTIONS] -i <de_novo.fasta.gz> -o <out.paf> -r <genome_reference_fasta>
 Input:
 	-i  fasta file of de novo contigs (ex: output of supernova)
-	-r  genome reference fasta file
+	-r  genome reference fasta file (or a minimap2 .mmi index of it)
 	--preset
-	-t	number of threads to use (default: 3)
+	-t	number of threads building the index and mapping the contigs (default: 3)
 Output:
-	-o  output file: alignment info
+	-o  output file: alignments, written as the contigs are mapped, in input order; the format follows the file name:
+	    .paf  PAF (with cs tags)
+	    .bam  BAM (unsorted, with cs tags)
+	    other tab-separated table of alignment info
+Options:
+	--index_dir  directory of cached minimap2 indexes: the reference is indexed once per preset, and later runs load the cached .mmi (checked against the reference, preset and a checksum of the index) (default: ~/.gemtools/mmi)
+	--assess  also write the assessment of the contigs to this file, as they are mapped -- the output of assess_contigs on the -o file, without reading it back
 			"""
 			sys.exit(1)
 		if not (args.infile or args.outfile or args.ref_file or args.preset):
@@ -566,11 +707,11 @@ Output:
 			print """
 Tool:	gemtools -T assess_contigs
 Summary: Assess whether contigs have rearranged structures\n
-Usage:   gemtools -T assess_contigs [OPTIONS] -i <aligned_contigs.txt> -o <out.txt>
+Usage:   gemtools -T assess_contigs [OPTIONS] -i <aligned_contigs.paf> -o <out.txt>
 Input:
-	-i  aligned contigs file (output of align_contigs)
+	-i  aligned contigs file (PAF or table output of align_contigs; the alignments of a contig must be consecutive)
 Output:
-	-o  output file: alignment info marked with assessment
+	-o  output file: alignment info marked with assessment (contigs with more than one aligned part are numbered, in input order)
 			"""
 			sys.exit(1)
 		if not (args.infile or args.outfile):
@@ -578,6 +719,8 @@ Output:
 		
 		if not os.path.isfile(args.infile):
 			parser.error(str(args.infile) + " does not exist")
+		if str(args.infile).endswith(".bam"):
+			parser.error("assess_contigs reads the PAF or table output of align_contigs, not BAM")
 	
 ##########################################################################################
 	if args.tool=="plot_vars_and_blocks":
@@ -586,16 +729,28 @@ Output:
 Tool:	gemtools -T plot_vars_and_blocks
 Summary: For a particular region, plot the heterozygous variants and phase blocks\n
 Usage:   gemtools -T plot_vars_and_blocks --basic <output.phased_basic.txt> --blocks <output.phased_blocks.txt> -f <region> -o <out.png>
+         gemtools -T plot_vars_and_blocks --basic <output.phased_basic.txt> --blocks <output.phased_blocks.txt> --manifest <regions.txt> [--nprocs <procs>]
+         gemtools -T plot_vars_and_blocks --basic <output.phased_basic.txt> --blocks <output.phased_blocks.txt> --bed <regions.bed> -o <out_prefix> [--nprocs <procs>]
 Input:
-	--basic  output from 'get_phased_basic' tool
-	--blocks	output from 'get_phase_blocks' tool
+	--basic  output from 'get_phased_basic' tool (if tabix-indexed, only the region is read)
+	--blocks	output from 'get_phase_blocks' tool (if tabix-indexed, only the region is read; otherwise a single region is read through its .bidx.npy interval index)
 	-f region of genome to consider; format 'chr1,1000,2000' or '1,1000,2000'
 Output:
 	-o  output file: plot of heterozygous variants and phase blocks
+Options:
+	--manifest  batch mode, instead of -f/-o: tab-separated file with one plot per line (region, output png); --basic and --blocks are read once for all plots
+	--bed  batch mode, instead of -f: BED file of regions (chrom, start, end[, name]), each read as with -f; --basic and --blocks are read once for all plots, and one plot is written per region, to <out_prefix>.<name>.png (<out_prefix>.<chrom>_<start>_<end>.png for regions without a name)
+	--nprocs  number of processes rendering the plots of a batch (default: 1)
 			"""
 			sys.exit(1)
-		if not (args.basic_in or args.blocks_in or args.region_in or args.outfile):
+		if not (args.basic_in or args.blocks_in or args.region_in or args.outfile or args.manifest):
 			parser.error('Missing required input')
+		if args.manifest and not os.path.isfile(args.manifest):
+			parser.error(str(args.manifest) + " does not exist")
+		if args.bed and not os.path.isfile(args.bed):
+			parser.error(str(args.bed) + " does not exist")
+		if args.bed and not args.outfile:
+			parser.error('--bed requires -o (output prefix)')
 		
 		if not os.path.isfile(args.basic_in):
 			parser.error(str(args.basic_in) + " does not exist")	
@@ -609,22 +764,63 @@ Output:
 Tool:	gemtools -T plot_haps_and_blocks
 Summary: For a particular region, plot the haplotypes and phase blocks\n
 Usage:   gemtools -T plot_haps_and_blocks --basic <output.phased_basic.txt> --blocks <output.phased_blocks.txt> -f <region> -o <out.png>
+         gemtools -T plot_haps_and_blocks --basic <output.phased_basic.txt> --blocks <output.phased_blocks.txt> --manifest <regions.txt> [--nprocs <procs>]
+         gemtools -T plot_haps_and_blocks --basic <output.phased_basic.txt> --blocks <output.phased_blocks.txt> --bed <regions.bed> -o <out_prefix> [--nprocs <procs>]
 Input:
-	--basic  output from 'get_phased_basic' tool
-	--blocks	output from 'get_phase_blocks' tool
+	--basic  output from 'get_phased_basic' tool (if tabix-indexed, only the region is read)
+	--blocks	output from 'get_phase_blocks' tool (if tabix-indexed, only the region is read; otherwise a single region is read through its .bidx.npy interval index)
 	-f region of genome to consider; format 'chr1,1000,2000' or '1,1000,2000'
 Output:
 	-o  output file: plot of haplotypes and phase blocks
+Options:
+	--manifest  batch mode, instead of -f/-o: tab-separated file with one plot per line (region, output png); --basic and --blocks are read once for all plots
+	--bed  batch mode, instead of -f: BED file of regions (chrom, start, end[, name]), each read as with -f; --basic and --blocks are read once for all plots, and one plot is written per region, to <out_prefix>.<name>.png (<out_prefix>.<chrom>_<start>_<end>.png for regions without a name)
+	--nprocs  number of processes rendering the plots of a batch (default: 1)
 			"""
 			sys.exit(1)
-		if not (args.basic_in or args.blocks_in or args.region_in or args.outfile):
+		if not (args.basic_in or args.blocks_in or args.region_in or args.outfile or args.manifest):
 			parser.error('Missing required input')
+		if args.manifest and not os.path.isfile(args.manifest):
+			parser.error(str(args.manifest) + " does not exist")
+		if args.bed and not os.path.isfile(args.bed):
+			parser.error(str(args.bed) + " does not exist")
+		if args.bed and not args.outfile:
+			parser.error('--bed requires -o (output prefix)')
 		
 		if not os.path.isfile(args.basic_in):
 			parser.error(str(args.basic_in) + " does not exist")	
 		if not os.path.isfile(args.blocks_in):
 			parser.error(str(args.blocks_in) + " does not exist")
 	
+##########################################################################################
+
+	if args.tool=="haplotag":
+		if args.help:
+			print """
+Tool:	gemtools -T haplotag
+Summary: Tag the reads in a bam file with the haplotype (HP) and phase block (PS) of their barcode\n
+Usage:   gemtools -T haplotag [OPTIONS] -b <LR.bam> -i <index_prefix> -o <out.haplotagged.bam>
+Input:
+	-b  indexed bam file generated by Long Ranger
+	-i  output prefix from 'index_phased_bcs' tool
+Output:
+	-o  output file: bam file with HP and PS tags added to reads with a phased barcode (indexed)
+Options:
+	-v  gzipped vcf file output from Long Ranger; builds the barcode index on the fly instead of -i
+	-t  number of bam compression threads per process (default: 3)
+	--nprocs  number of processes; each process tags one chromosome at a time (default: 1)
+			"""
+			sys.exit(1)
+		if not (args.bam and args.outfile and (args.infile or args.vcf)):
+			parser.error('Missing required input')
+
+		if not str(args.bam).endswith(".bam"):
+			parser.error(str(args.bam) + " does not appear to be a bam file")
+		if not str(args.outfile).endswith(".bam"):
+			parser.error(str(args.outfile) + " : Output file must be a bam file, ex: out.bam")
+		if not args.infile and not str(args.vcf).endswith(".vcf.gz"):
+			parser.error(str(args.vcf) + " does not appear to be a gzipped vcf file")
+
 ##########################################################################################
 
 	pipeline = pipeline_from_parsed_args(args)
@@ -1,6 +1,7 @@
-import mappy as mp
+from gemtools.mm_index import load_aligner
+from gemtools.contig_mapper import map_contigs, hit_writer, AssessmentWriter
 
-def align_contigs(**kwargs):
+def align_contigs(index_dir=None,assess_out=None,**kwargs):
 
 	if 'infile_fasta' in kwargs:
 		infile = kwargs['infile_fasta']
@@ -12,19 +13,27 @@ def align_contigs(**kwargs):
 		preset = kwargs['preset']
 	if 'nthreads' in kwargs:
 		nthreads = kwargs['nthreads']
-
-	a = mp.Aligner(str(genome), preset=preset, n_threads = nthreads)
-
-	if not a: raise Exception("ERROR: failed to load/build index")
-
-	outfile = open(outfile, 'w')
-
-	outfile.write("read\tchr\tpos\tr_st\tr_en\tq_st\tq_en\tq_len\tprimary\tstrand\tcs\tcigstr\tcigtup\n")
-
-	for name, seq, qual in mp.fastx_read(infile):
-		seq_len = len(seq)
-		print name
-		for hit in a.map(seq, cs=True):
-			outfile.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(name, hit.ctg, hit.r_st, hit.r_st, hit.r_en, hit.q_st, hit.q_en, seq_len, hit.is_primary, hit.strand, hit.cs, hit.cigar_str, hit.cigar))
-
-	outfile.close()
+	if 'index_dir' in kwargs:
+		index_dir = kwargs['index_dir']
+	if 'assess_out' in kwargs:
+		assess_out = kwargs['assess_out']
+
+	# the reference is indexed once per preset; later runs load the cached index (see mm_index)
+	a = load_aligner(genome, preset, nthreads, index_dir)
+
+	# contigs are mapped by nthreads threads and written in input order, as they are mapped (PAF, BAM or TSV, following
+	# the output file name -- see contig_mapper)
+	# with assess_out, each contig is also assessed as soon as its hits are back (no intermediate file or sort)
+	out = hit_writer(outfile, a, genome, preset, index_dir)
+	assessment = AssessmentWriter(assess_out, str(outfile).endswith(".paf")) if str(assess_out)!="None" else None
+	num_contigs = 0
+	for name, seq, hits in map_contigs(a, infile, nthreads):
+		out.write(name, seq, hits)
+		if assessment:
+			assessment.write(name, seq, hits)
+		num_contigs = num_contigs + 1
+	out.close()
+	print "%d contigs mapped" % num_contigs
+	if assessment:
+		assessment.close()
+		print "%d contigs assessed, %d with more than one aligned part" % (assessment.num_contigs, assessment.num_interesting)
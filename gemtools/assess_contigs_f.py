@@ -1,4 +1,4 @@
-import pandas as pd
+from gemtools.contig_assess import assess_hit_file
 
 def assess_contigs(**kwargs):
 
@@ -7,31 +7,7 @@ def assess_contigs(**kwargs):
 	if 'out' in kwargs:
 		outfile = kwargs['out']
 
-	df = pd.read_csv(infile, sep="\t", index_col = False)
-	df.sort_values(by=['read','pos'], inplace=True)
-	print df
-	#df['interesting'] = False 
-	#grouped = df.groupby('read').filter(lambda x: len(x)>=2) #only reads that appear 2+ times
-	grouped = df.groupby('read')
+	# one pass over the alignment records (TSV or PAF output of align_contigs, grouped by contig), chunk by chunk
+	assessor = assess_hit_file(infile, outfile)
 
-	assess_list=[]
-
-	i=0
-	for name, group in grouped:
-		group_dedup = group.drop_duplicates(subset=['q_st','q_en']) #only interested if multiple parts of contig map
-		
-		if len(group_dedup.index)>1: #interesting
-			i += 1
-			assess_list.append([name,i])
-		else:
-			assess_list.append([name,"False"])
-		
-	print assess_list
-
-	df_assess = pd.DataFrame(assess_list, columns=['read','interesting'])
-	print df_assess
-
-	df_comb = pd.merge(df, df_assess, on="read", how="left")
-
-	#df_interesting = df.query('interesting == True')
-	df_comb.to_csv(outfile, sep="\t", index=False)
+	print "%d contigs assessed, %d with more than one aligned part" % (assessor.num_contigs, assessor.num_interesting)
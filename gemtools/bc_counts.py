@@ -0,0 +1,83 @@
+from collections import Counter
+import pandas as pd
+import numpy as np
+
+## BARCODE COUNT TABLES (output of 'count_bcs' and 'count_bcs_list'), in one of two formats
+##   wide: the window columns (id, name, chrom, window_start, window_end for count_bcs; chrom, window_start, window_end
+##         for count_bcs_list), then one column per barcode, with the number of reads of the barcode in the window
+##   long: the window columns, then barcode and count -- one row per (window, barcode) with reads, windows in the order
+##         they were counted; written window by window, as the windows are counted
+## readers work on the (window, barcode) pairs with reads ("hits") of either format
+
+WINDOW_COLS = ['id','name','chrom','window_start','window_end']
+LONG_COLS = ['barcode','count']
+
+def count_window_bcs(bam_in, chrom, start, end, min_mapq, bc_set):
+	# number of reads of each barcode in bc_set in the window
+	counts = Counter()
+	for r in bam_in.fetch(chrom, start, end):
+		if r.mapq >= min_mapq and r.has_tag("BX"):
+			bc_id = r.get_tag("BX")
+			if bc_id in bc_set:
+				counts[bc_id] += 1
+	return counts
+
+
+class LongCountWriter(object):
+	"""Writes barcode counts in long format, one window at a time"""
+
+	def __init__(self, outfile, window_cols, bc_list):
+		self.out = open(outfile, 'w')
+		self.out.write("\t".join(window_cols + LONG_COLS) + "\n")
+		# barcodes of a window are written in bc_list order
+		self.bc_pos = dict((bc,i) for i,bc in enumerate(bc_list))
+
+	def write(self, window, counts):
+		prefix = "\t".join([str(w) for w in window]) + "\t"
+		for bc in sorted(counts, key=self.bc_pos.get):
+			self.out.write(prefix + str(bc) + "\t" + str(counts[bc]) + "\n")
+
+	def close(self):
+		self.out.close()
+
+
+def is_long_table(df):
+	return all([c in df.columns for c in LONG_COLS])
+
+def count_hits(df):
+	"""(hits, barcodes) of a count table in either format: hits has the window columns of the table, the window's row
+	number ('row', in table order), the barcode ('bc', an index into barcodes) and 'count', ordered by row then barcode"""
+	window_cols = [c for c in WINDOW_COLS if c in df.columns]
+
+	if is_long_table(df):
+		df = df.loc[df['count']>0]
+		# a new window starts wherever the window columns change; barcodes are numbered in order of first appearance
+		keys = df[window_cols].values
+		new_window = np.ones(len(df), dtype=bool)
+		if len(df)>1:
+			new_window[1:] = (keys[1:]!=keys[:-1]).any(axis=1)
+		(bc, barcodes) = pd.factorize(df['barcode'].astype(str).values)
+		hits = df[window_cols].reset_index(drop=True)
+		hits['row'] = np.cumsum(new_window) - 1
+		hits['bc'] = bc
+		hits['count'] = df['count'].values
+		order = np.lexsort((hits['bc'].values, hits['row'].values))
+		return (hits.iloc[order].reset_index(drop=True), list(barcodes))
+
+	barcodes = [c for c in df.columns if c not in WINDOW_COLS]
+	counts = df[barcodes].values
+	(rows, cols) = np.nonzero(counts > 0)
+	hits = pd.DataFrame(dict([(c, df[c].values[rows]) for c in window_cols]), columns=window_cols)
+	hits['row'] = rows
+	hits['bc'] = cols
+	hits['count'] = counts[rows, cols]
+	return (hits, barcodes)
+
+def write_long_hits(hits, barcodes, keep, outfile):
+	"""Long format count table of the hits of the barcodes with keep[bc] set"""
+	window_cols = [c for c in WINDOW_COLS if c in hits.columns]
+	hits = hits.loc[np.asarray(keep)[hits['bc'].values]]
+	out = hits[window_cols].copy()
+	out['barcode'] = np.array(barcodes, dtype=object)[hits['bc'].values]
+	out['count'] = hits['count'].values
+	out.to_csv(outfile, sep="\t", index=False)
@@ -0,0 +1,163 @@
+import csv
+import ast
+from operator import itemgetter
+from itertools import compress
+
+## LOOKUP OF THE 16 BP GEM BARCODE AT THE START OF A READ
+## the dict is keyed on the raw 16-mer string, so matching a read is one hash lookup,
+## independent of the number of barcodes requested
+## with barcode correction, the 16-mers one mismatch away from a requested barcode are added to the
+## same table, so a corrected match costs no more than an exact one
+
+BC_LEN = 16
+BASES = "ACGTN"
+
+def one_mismatch_neighbors(bc_seq):
+	for p in xrange(len(bc_seq)):
+		for b in BASES:
+			if b!=bc_seq[p]:
+				yield bc_seq[:p] + b + bc_seq[p+1:]
+
+class BarcodeMatcher(object):
+
+	def __init__(self, bc_file):
+		self.bcs = []
+		self.lookup = {}
+		with open(bc_file,'r') as f:
+			for line in csv.reader(f,delimiter='\t'):
+				if not line or not line[0]:
+					continue
+				bc_seq = line[0].split("-")[0]
+				if bc_seq not in self.lookup:
+					self.lookup[bc_seq] = len(self.bcs)
+					self.bcs.append(line[0])
+		self.counts = [0]*len(self.bcs)
+		self.corrected_counts = None
+		self.table = self.lookup
+
+	def enable_correction(self):
+		# a 16-mer one mismatch (or N) away from exactly one requested barcode is matched to it; 16-mers
+		# within one mismatch of two requested barcodes are ambiguous and stay unmatched
+		neighbors = {}
+		ambiguous = set()
+		for bc_seq,i in self.lookup.iteritems():
+			for nb in one_mismatch_neighbors(bc_seq):
+				if nb in self.lookup:
+					continue
+				if nb in neighbors:
+					ambiguous.add(nb)
+				else:
+					neighbors[nb] = i
+		for nb in ambiguous:
+			del neighbors[nb]
+		self.table = dict(self.lookup)
+		self.table.update(neighbors)
+		self.corrected_counts = [0]*len(self.bcs)
+		self.num_ambiguous = len(ambiguous)
+
+	def match(self, seq):
+		# index of the barcode that seq starts with, or None
+		i = self.lookup.get(seq[0:BC_LEN])
+		if i is not None:
+			self.counts[i] += 1
+		return i
+
+	def select(self, seqs):
+		# indices of the reads (given as sequences) that start with a requested barcode;
+		# slicing and lookups run as builtin map() calls, so only matching reads reach python code
+		prefixes = map(itemgetter(slice(0,BC_LEN)), seqs)
+		keep = list(compress(xrange(len(prefixes)), map(self.table.__contains__, prefixes)))
+		if self.corrected_counts is None:
+			for k in keep:
+				self.counts[self.table[prefixes[k]]] += 1
+		else:
+			for k in keep:
+				i = self.table[prefixes[k]]
+				self.counts[i] += 1
+				if prefixes[k] not in self.lookup:
+					self.corrected_counts[i] += 1
+		return keep
+
+	def correction_summary(self):
+		# appended to the run summary: exact and corrected matches are reported separately
+		if self.corrected_counts is None:
+			return ""
+		num_corrected = sum(self.corrected_counts)
+		return "; %d records matched exactly, %d by barcode correction (%d ambiguous one-mismatch 16-mers ignored)" % (sum(self.counts) - num_corrected, num_corrected, self.num_ambiguous)
+
+	def num_matched_bcs(self):
+		return len([c for c in self.counts if c>0])
+
+	def write_counts(self, outfile):
+		# reads matched per requested barcode -- 0 means the barcode was never seen
+		with open(outfile,'w') as f:
+			if self.corrected_counts is None:
+				f.write("barcode\treads\n")
+				for bc,c in zip(self.bcs, self.counts):
+					f.write(str(bc) + "\t" + str(c) + "\n")
+			else:
+				# reads includes the corrected ones
+				f.write("barcode\treads\tcorrected_reads\n")
+				for bc,c,cc in zip(self.bcs, self.counts, self.corrected_counts):
+					f.write(str(bc) + "\t" + str(c) + "\t" + str(cc) + "\n")
+
+def read_bc_manifest(manifest):
+	"""Named barcode sets, from get_shared_bcs output (name, num_bcs, bcs) or a two-column (set_name, barcode) table"""
+	set_names = []
+	set_bcs = {}
+	with open(manifest,'r') as f:
+		rows = [line for line in csv.reader(f,delimiter='\t') if line and line[0] and not line[0].startswith("#")]
+
+	if rows and rows[0][0]=="name" and "bcs" in rows[0]:
+		bc_col = rows[0].index("bcs")
+		named_bcs = [(row[0], list(ast.literal_eval(row[bc_col]))) for row in rows[1:]]
+	else:
+		named_bcs = [(row[0], [row[1]]) for row in rows]
+
+	for (name, bcs) in named_bcs:
+		if name not in set_bcs:
+			set_names.append(name)
+			set_bcs[name] = []
+		set_bcs[name].extend(bcs)
+	return (set_names, [set_bcs[name] for name in set_names])
+
+class BarcodeSetMatcher(BarcodeMatcher):
+	# a barcode can belong to several sets; each barcode maps to the (sorted) indices of its sets
+
+	def __init__(self, manifest):
+		(self.set_names, set_bcs) = read_bc_manifest(manifest)
+		self.bcs = []
+		self.lookup = {}
+		self.bc_sets = []
+		for s,bcs in enumerate(set_bcs):
+			for bc in bcs:
+				bc_seq = bc.split("-")[0]
+				i = self.lookup.get(bc_seq)
+				if i is None:
+					i = len(self.bcs)
+					self.lookup[bc_seq] = i
+					self.bcs.append(bc)
+					self.bc_sets.append([])
+				if self.bc_sets[i][-1:]!=[s]:
+					self.bc_sets[i].append(s)
+		self.counts = [0]*len(self.bcs)
+		self.corrected_counts = None
+		self.table = self.lookup
+		self.set_num_bcs = [len(set([bc.split("-")[0] for bc in bcs])) for bcs in set_bcs]
+		self.set_counts = [0]*len(self.set_names)
+
+	def route(self, seqs):
+		# {set index: indices of the reads whose barcode is in the set}
+		routes = {}
+		for k in self.select(seqs):
+			for s in self.bc_sets[self.table[seqs[k][0:BC_LEN]]]:
+				routes.setdefault(s, []).append(k)
+		for s,keep in routes.items():
+			self.set_counts[s] += len(keep)
+		return routes
+
+	def write_set_counts(self, outfile):
+		with open(outfile,'w') as f:
+			f.write("set_name\tnum_bcs\treads\n")
+			for name,b,c in zip(self.set_names, self.set_num_bcs, self.set_counts):
+				f.write(str(name) + "\t" + str(b) + "\t" + str(c) + "\n")
@@ -0,0 +1,64 @@
+import zlib
+import struct
+
+## BGZF (blocked gzip) OUTPUT
+## data is cut into independent gzip members of at most BLOCK_DATA bytes, so blocks can be compressed
+## in parallel by a (thread) pool and written in order; zlib releases the GIL while deflating.
+## the output is a valid multi-member gzip file that htslib/samtools/bgzip also read as BGZF
+
+BLOCK_DATA = 0xff00
+MAX_BLOCK_SIZE = 0x10000
+BGZF_EOF = "\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+def compress_block(block_args):
+	(data, level) = block_args
+	c = zlib.compressobj(level, zlib.DEFLATED, -15)
+	cdata = c.compress(data) + c.flush()
+	if len(cdata) + 26 > MAX_BLOCK_SIZE:
+		# incompressible data: split so that each member fits the 64 kb BGZF limit
+		half = len(data)//2
+		return compress_block((data[:half], level)) + compress_block((data[half:], level))
+	header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(cdata) + 25)
+	return header + cdata + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data) & 0xffffffff)
+
+class BgzfWriter(object):
+
+	def __init__(self, path, level=6, pool=None, mode='wb'):
+		self.handle = open(path, mode)
+		self.level = int(level)
+		self.pool = pool
+		self.buffer = ""
+
+	def write(self, data):
+		self.buffer = self.buffer + data
+		num_full = len(self.buffer)//BLOCK_DATA
+		if num_full>0:
+			blocks = [self.buffer[k*BLOCK_DATA:(k+1)*BLOCK_DATA] for k in xrange(num_full)]
+			self.buffer = self.buffer[num_full*BLOCK_DATA:]
+			self.write_blocks(blocks)
+
+	def write_blocks(self, blocks):
+		block_args = [(b, self.level) for b in blocks]
+		if self.pool is not None:
+			self.handle.write("".join(self.pool.map(compress_block, block_args)))
+		else:
+			self.handle.write("".join(map(compress_block, block_args)))
+
+	def flush(self):
+		# ends the current (partial) block, so everything written so far is on disk as whole blocks
+		if self.buffer:
+			self.write_blocks([self.buffer])
+			self.buffer = ""
+		self.handle.flush()
+
+	def tell(self):
+		return self.handle.tell()
+
+	def fileno(self):
+		return self.handle.fileno()
+
+	def close(self, eof=True):
+		self.flush()
+		if eof:
+			self.handle.write(BGZF_EOF)
+		self.handle.close()
@@ -0,0 +1,115 @@
+import os
+from StringIO import StringIO
+import numpy as np
+import pandas as pd
+
+## INTERVAL INDEX OF PHASE BLOCKS (output of 'get_phase_blocks')
+## blocks are sorted by (chrom, beg_pos) and carry the running maximum of end_pos within their chromosome; the blocks
+## overlapping [start, stop] begin at or before stop (a prefix of the chromosome, found by binary search) and end at
+## or after start, which no block before the first one whose running maximum reaches start does (that block is also
+## found by binary search) -- so a query reads only the blocks between the two
+## coordinates are inclusive at both ends: a block overlaps a region when they share at least one position
+##
+## ON-DISK LAYOUT (next to the blocks file)
+##   <blocks file>.bidx.npy  one row per block: chrom, beg, end, running max end, row number of the block in the blocks
+##                           file and byte offset of its line (-1 for an index of a table held in memory)
+
+BLOCK_INDEX_DTYPE = np.dtype([('chrom','S64'),('beg','i8'),('end','i8'),('max_end','i8'),('row','i8'),('offset','i8')])
+
+BLOCK_INDEX_SUFFIX = ".bidx.npy"
+
+
+class BlockIndex(object):
+	"""Interval index of the phase blocks of a blocks table"""
+
+	def __init__(self, blocks):
+		self.blocks = blocks
+
+	def overlapping(self, chrom, start, stop):
+		"""Index rows (sorted by row number) of the blocks that overlap chrom:start-stop"""
+		chroms = self.blocks['chrom']
+		lo = np.searchsorted(chroms, str(chrom), side='left')
+		hi = np.searchsorted(chroms, str(chrom), side='right')
+		j = lo + np.searchsorted(self.blocks['beg'][lo:hi], int(stop), side='right')
+		i = lo + np.searchsorted(self.blocks['max_end'][lo:j], int(start), side='left')
+		hits = self.blocks[i:j]
+		hits = hits[hits['end']>=int(start)]
+		return hits[np.argsort(hits['row'], kind='mergesort')]
+
+	def rows(self, chrom, start, stop):
+		"""Row numbers, in the blocks table, of the blocks that overlap chrom:start-stop"""
+		return self.overlapping(chrom, start, stop)['row']
+
+	def fetch(self, blocks_file, chrom, start, stop):
+		"""The blocks that overlap chrom:start-stop, read from blocks_file (the file the index was built from)"""
+		offsets = self.overlapping(chrom, start, stop)['offset']
+		with open(blocks_file, 'r') as f:
+			lines = [f.readline()]
+			for o in offsets:
+				f.seek(int(o))
+				lines.append(f.readline())
+		return pd.read_csv(StringIO("".join(lines)), sep="\t")
+
+	def save(self, blocks_file):
+		np.save(blocks_file + BLOCK_INDEX_SUFFIX, np.asarray(self.blocks))
+
+
+def index_blocks(chroms, begs, ends, rows, offsets):
+	blocks = np.zeros(len(rows), dtype=BLOCK_INDEX_DTYPE)
+	blocks['chrom'] = np.asarray(chroms, dtype=str)
+	blocks['beg'] = begs
+	blocks['end'] = ends
+	blocks['row'] = rows
+	blocks['offset'] = offsets
+	blocks = blocks[np.lexsort((blocks['beg'], blocks['chrom']))]
+
+	# running maximum of the block ends, restarted on each chromosome
+	first = np.nonzero(np.append(True, blocks['chrom'][1:]!=blocks['chrom'][:-1]))[0]
+	for (s,e) in zip(first, np.append(first[1:], len(blocks))):
+		blocks['max_end'][s:e] = np.maximum.accumulate(blocks['end'][s:e])
+	return BlockIndex(blocks)
+
+
+def block_index_from_table(df):
+	"""Index of a blocks table held in memory (columns 'chr', 'beg_pos', 'end_pos'); rows are positions in df"""
+	return index_blocks(df['chr'].astype(str).values, df['beg_pos'].values, df['end_pos'].values, np.arange(len(df)), np.repeat(-1, len(df)))
+
+
+def build_block_index(blocks_file):
+	"""Index of a (plain text) blocks file, with the byte offset of every block's line"""
+	offsets = []
+	with open(blocks_file, 'r') as f:
+		f.readline()
+		while True:
+			o = f.tell()
+			line = f.readline()
+			if not line:
+				break
+			if line.strip():
+				offsets.append(o)
+	df = pd.read_table(blocks_file, sep="\t", usecols=['chr','beg_pos','end_pos'], dtype={'chr':str})
+	return index_blocks(df['chr'].values, df['beg_pos'].values, df['end_pos'].values, np.arange(len(df)), offsets)
+
+
+def block_index_is_current(blocks_file):
+	index_file = blocks_file + BLOCK_INDEX_SUFFIX
+	return os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(blocks_file)
+
+
+def load_block_index(blocks_file):
+	"""Open the index saved next to blocks_file; the array is memory-mapped, not read"""
+	if not os.path.isfile(blocks_file + BLOCK_INDEX_SUFFIX):
+		raise IOError(str(blocks_file + BLOCK_INDEX_SUFFIX) + " does not exist")
+	return BlockIndex(np.load(blocks_file + BLOCK_INDEX_SUFFIX, mmap_mode='r'))
+
+
+def open_block_index(blocks_file):
+	"""The index of blocks_file: the saved one if it is current, otherwise a new one (saved next to the file if possible)"""
+	if block_index_is_current(blocks_file):
+		return load_block_index(blocks_file)
+	block_index = build_block_index(blocks_file)
+	try:
+		block_index.save(blocks_file)
+	except (IOError, OSError):
+		pass
+	return block_index
@@ -0,0 +1,31 @@
+import os
+import json
+
+## CHECKPOINT OF A FASTQ EXTRACTION RUN
+## a json file with the records processed and matched so far, the size of each output holding exactly
+## those records (ending on a BGZF block boundary) and the per-barcode counts; it is replaced atomically,
+## so a killed run always leaves the last complete checkpoint behind
+
+def input_signature(path):
+	st = os.stat(path)
+	return {'path': os.path.abspath(path), 'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+def write_checkpoint(checkpoint_file, state):
+	tmp_file = checkpoint_file + ".tmp"
+	with open(tmp_file,'w') as f:
+		json.dump(state, f)
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(tmp_file, checkpoint_file)
+
+def read_checkpoint(checkpoint_file):
+	with open(checkpoint_file,'r') as f:
+		return json.load(f)
+
+def truncate_outputs(paths, sizes):
+	# drops whatever was written after the checkpoint
+	for path,size in zip(paths, sizes):
+		if not os.path.isfile(path) or os.path.getsize(path) < size:
+			raise IOError(str(path) + " is shorter than recorded in the checkpoint")
+		with open(path,'r+b') as f:
+			f.truncate(size)
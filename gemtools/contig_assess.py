@@ -0,0 +1,122 @@
+import gzip
+from itertools import islice
+import numpy as np
+import pandas as pd
+
+## ASSESSMENT OF ALIGNED CONTIGS (output of 'align_contigs', TSV or PAF)
+## a contig may contain a rearranged structure when more than one part of it aligns, ie. its alignments have more than
+## one distinct (q_st, q_en); contigs that do are numbered 1, 2, ... in input order, the others are marked False
+## records are read in chunks and must be grouped by contig name (as align_contigs writes them); the contig at the end
+## of a chunk is held back until its last record is read, so memory is bounded by the chunk size, not the file size
+##
+## OUTPUT: the records, with the 'interesting' column; contigs in input order, the records of a contig by position
+## (align_contigs --assess writes the same, contig by contig as they are mapped -- see contig_mapper.AssessmentWriter)
+
+CHUNK_SIZE = 100000
+
+PAF_COLS = ['read','q_len','q_st','q_en','strand','chr','chr_len','r_st','r_en','matches','aln_len','mapq','tags']
+
+def num_aligned_parts(hits):
+	"""Number of distinct aligned parts (q_st, q_en) of the alignments of one contig"""
+	return len(set([(h.q_st, h.q_en) for h in hits]))
+
+def is_paf(infile):
+	return str(infile).endswith(".paf") or str(infile).endswith(".paf.gz")
+
+def read_paf_chunks(infile, chunk_size):
+	# the 12 standard columns, then the tags (in one column, space-separated)
+	with (gzip.open(infile, 'rb') if str(infile).endswith(".gz") else open(infile, 'r')) as f:
+		while True:
+			lines = [l.rstrip("\r\n").split("\t", 12) for l in islice(f, chunk_size)]
+			if not lines:
+				break
+			df = pd.DataFrame(lines).reindex(columns=range(len(PAF_COLS)))
+			df.columns = PAF_COLS
+			df['tags'] = df['tags'].str.replace("\t", " ")
+			for c in ['q_len','q_st','q_en','chr_len','r_st','r_en','matches','aln_len','mapq']:
+				df[c] = df[c].astype(int)
+			yield df
+
+def read_hit_chunks(infile, chunk_size=CHUNK_SIZE):
+	"""(records, position column) of an align_contigs output file, in chunks of chunk_size records"""
+	if is_paf(infile):
+		return (read_paf_chunks(infile, chunk_size), 'r_st')
+	return (pd.read_csv(infile, sep="\t", index_col=False, chunksize=chunk_size), 'pos')
+
+
+class ContigAssessor(object):
+	"""Classifies the contigs of a stream of alignment records, chunk by chunk"""
+
+	def __init__(self, pos_col):
+		self.pos_col = pos_col
+		self.held = None
+		self.prev_names = set()
+		self.num_contigs = 0
+		self.num_interesting = 0
+
+	def assess(self, df, complete=False):
+		"""The records of the contigs that are complete after df, with 'interesting'; complete: df ends with the
+		last record of its last contig (otherwise that contig is held back until the next chunk)"""
+		if self.held is not None:
+			df = pd.concat([self.held, df], ignore_index=True)
+			self.held = None
+		if len(df)==0:
+			return df.assign(interesting=[])
+
+		# a new contig starts wherever the name changes
+		names = df['read'].astype(str).values
+		new_contig = np.ones(len(df), dtype=bool)
+		new_contig[1:] = names[1:]!=names[:-1]
+		contig = np.cumsum(new_contig) - 1
+		if not complete:
+			last = contig==contig[-1]
+			self.held = df.loc[last].reset_index(drop=True)
+			(df, names, new_contig, contig) = (df.loc[~last], names[~last], new_contig[~last], contig[~last])
+			if len(df)==0:
+				return df.assign(interesting=[])
+
+		# a name that comes back within the chunk, or from the contigs completed by the previous chunk, is a contig whose
+		# records are not consecutive (only the previous chunk's names are kept, so memory stays bounded by the chunk size)
+		starts = names[new_contig]
+		names_set = set(starts)
+		if len(names_set)<len(starts) or not self.prev_names.isdisjoint(names_set):
+			raise ValueError("alignment records are not grouped by contig (a contig's records must be consecutive, as align_contigs writes them)")
+		self.prev_names = names_set
+
+		# number of distinct aligned parts (q_st, q_en) of every contig, at once (num_aligned_parts for a single contig)
+		parts = pd.DataFrame({'contig': contig, 'q_st': df['q_st'].values, 'q_en': df['q_en'].values}).drop_duplicates()
+		num_contigs = len(starts)
+		interesting = np.bincount(parts['contig'].values, minlength=num_contigs) > 1
+		labels = np.where(interesting, (self.num_interesting + np.cumsum(interesting)).astype(str), "False")
+		self.num_contigs = self.num_contigs + num_contigs
+		self.num_interesting = self.num_interesting + int(interesting.sum())
+
+		order = np.lexsort((df[self.pos_col].values, contig))
+		df = df.iloc[order].reset_index(drop=True)
+		df['interesting'] = labels[contig[order]]
+		return df
+
+	def flush(self):
+		"""The records of the held-back contig, once the stream has ended"""
+		held = self.held
+		self.held = None
+		if held is None:
+			return None
+		return self.assess(held, complete=True)
+
+
+def assess_hit_file(infile, outfile, chunk_size=CHUNK_SIZE):
+	"""Writes the records of infile with their assessment to outfile; returns the ContigAssessor (for its counts)"""
+	(chunks, pos_col) = read_hit_chunks(infile, chunk_size)
+	assessor = ContigAssessor(pos_col)
+	header = True
+	with open(outfile, 'w') as out:
+		for df in chunks:
+			df = assessor.assess(df)
+			if len(df):
+				df.to_csv(out, sep="\t", index=False, header=header)
+				header = False
+		df = assessor.flush()
+		if df is not None and (len(df) or header):
+			df.to_csv(out, sep="\t", index=False, header=header)
+	return assessor
@@ -0,0 +1,196 @@
+import sys
+from Queue import Queue
+import mappy as mp
+import pysam
+
+from gemtools.fastq_pipeline import StageError, start_thread
+from gemtools.contig_assess import PAF_COLS, num_aligned_parts
+from gemtools.mm_index import reference_lengths
+
+## THREADED CONTIG MAPPING
+##   reader thread (mp.fastx_read) -> bounded queue of numbered contig batches
+##     -> mapping threads, each with its own mp.ThreadBuffer -> queue of mapped batches
+##     -> caller, which gets the contigs back in input order (batches that finish early wait until their turn)
+## mappy releases the GIL while it maps, so the mapping threads run in parallel; the queues hold at most QUEUE_SIZE
+## batches per thread, so memory is capped regardless of the number of contigs
+
+BATCH_SIZE = 50
+QUEUE_SIZE = 4
+
+def read_contig_batches(infile, batch_size, queue, num_workers):
+	try:
+		batch = []
+		j = 0
+		for name, seq, qual in mp.fastx_read(infile):
+			batch.append((name, seq))
+			if len(batch)==batch_size:
+				queue.put((j, batch))
+				j = j + 1
+				batch = []
+		if batch:
+			queue.put((j, batch))
+	except Exception:
+		queue.put(StageError(sys.exc_info()))
+	for w in range(num_workers):
+		queue.put(None)
+
+def map_batches(aligner, in_queue, out_queue):
+	buf = mp.ThreadBuffer()
+	while True:
+		item = in_queue.get()
+		if item is None or isinstance(item, StageError):
+			out_queue.put(item)
+			if item is None:
+				break
+			continue
+		try:
+			(j, batch) = item
+			out_queue.put((j, [(name, seq, list(aligner.map(seq, buf=buf, cs=True))) for (name, seq) in batch]))
+		except Exception:
+			out_queue.put(StageError(sys.exc_info()))
+
+def map_contigs(aligner, infile, nthreads=1, batch_size=BATCH_SIZE):
+	"""Yields (name, seq, hits) for every contig of infile, in input order; hits are mapped with cs tags"""
+	nthreads = max(1, int(nthreads))
+	if nthreads==1:
+		buf = mp.ThreadBuffer()
+		for name, seq, qual in mp.fastx_read(infile):
+			yield (name, seq, list(aligner.map(seq, buf=buf, cs=True)))
+		return
+
+	in_queue = Queue(QUEUE_SIZE*nthreads)
+	out_queue = Queue(QUEUE_SIZE*nthreads)
+	start_thread(read_contig_batches, (infile, batch_size, in_queue, nthreads))
+	for t in range(nthreads):
+		start_thread(map_batches, (aligner, in_queue, out_queue))
+
+	pending = {}
+	next_j = 0
+	num_done = 0
+	while num_done<nthreads:
+		item = out_queue.get()
+		if item is None:
+			num_done = num_done + 1
+			continue
+		if isinstance(item, StageError):
+			item.reraise()
+		pending[item[0]] = item[1]
+		while next_j in pending:
+			for contig in pending.pop(next_j):
+				yield contig
+			next_j = next_j + 1
+
+
+## OUTPUT OF MAPPED CONTIGS, written contig by contig as they are mapped; the format follows the output file name
+##   .paf  PAF (minimap2's: the 12 standard columns, then the tp, ts, cg and cs tags)
+##   .bam  BAM, unsorted (contigs in input order), with cs, NM and tp tags; the first primary alignment of a contig
+##         is its representative alignment (with the contig sequence, soft-clipped), the other primary alignments are
+##         supplementary and the secondary ones secondary (both hard-clipped, without sequence)
+##   other TSV with a header, one row per alignment (columns of TSV_COLS)
+
+TSV_COLS = ['read','chr','pos','r_st','r_en','q_st','q_en','q_len','primary','strand','cs','cigstr','cigtup']
+
+def tsv_record(name, seq, hit):
+	return [name, hit.ctg, hit.r_st, hit.r_st, hit.r_en, hit.q_st, hit.q_en, len(seq), hit.is_primary, hit.strand, hit.cs, hit.cigar_str, hit.cigar]
+
+def paf_record(name, seq, hit):
+	# the columns of PAF_COLS (see contig_assess): the 12 standard ones, then the tags
+	return [name, len(seq)] + str(hit).split("\t", 10)
+
+class TsvHitWriter(object):
+
+	def __init__(self, outfile):
+		self.out = open(outfile, 'w')
+		self.out.write("\t".join(TSV_COLS) + "\n")
+
+	def write(self, name, seq, hits):
+		for hit in hits:
+			self.out.write("\t".join([str(f) for f in tsv_record(name, seq, hit)]) + "\n")
+
+	def close(self):
+		self.out.close()
+
+class PafHitWriter(object):
+
+	def __init__(self, outfile):
+		self.out = open(outfile, 'w')
+
+	def write(self, name, seq, hits):
+		for hit in hits:
+			self.out.write("\t".join([str(f) for f in paf_record(name, seq, hit)]) + "\n")
+
+	def close(self):
+		self.out.close()
+
+class BamHitWriter(object):
+
+	def __init__(self, outfile, aligner, genome, preset=None, index_dir=None):
+		refs = reference_lengths(aligner, genome, preset, index_dir)
+		header = {'HD': {'VN': '1.6', 'SO': 'unsorted'}, 'SQ': [{'SN': n, 'LN': l} for (n,l) in refs]}
+		self.out = pysam.AlignmentFile(outfile, 'wb', header=header)
+		self.ref_ids = dict((n,i) for i,(n,l) in enumerate(refs))
+
+	def write(self, name, seq, hits):
+		rc_seq = None
+		representative = True
+		for hit in hits:
+			r = pysam.AlignedSegment()
+			r.query_name = name
+			r.reference_id = self.ref_ids[hit.ctg]
+			r.reference_start = hit.r_st
+			r.mapping_quality = hit.mapq
+			if hit.is_primary and representative:
+				r.flag = 16 if hit.strand<0 else 0
+				clip = 4
+			else:
+				r.flag = (16 if hit.strand<0 else 0) | (2048 if hit.is_primary else 256)
+				clip = 5
+			# the cigar covers the whole contig, on the reference strand
+			(left, right) = (hit.q_st, len(seq)-hit.q_en) if hit.strand>0 else (len(seq)-hit.q_en, hit.q_st)
+			cigar = [(op, l) for (l, op) in hit.cigar]
+			r.cigartuples = ([(clip, left)] if left else []) + cigar + ([(clip, right)] if right else [])
+			if clip==4:
+				if hit.strand<0 and rc_seq is None:
+					rc_seq = mp.revcomp(seq)
+				r.query_sequence = rc_seq if hit.strand<0 else seq
+				representative = False
+			r.set_tags([('NM', hit.NM), ('tp', 'P' if hit.is_primary else 'S', 'A'), ('cs', hit.cs)])
+			self.out.write(r)
+
+	def close(self):
+		self.out.close()
+
+class AssessmentWriter(object):
+	"""Writes the assessment of every contig as it is mapped (as assess_contigs would write it for the hit table): the
+	records of the -o format (TSV layout for BAM), by position, with 'interesting'"""
+
+	def __init__(self, outfile, paf):
+		(self.cols, self.record, self.pos_col) = (PAF_COLS, paf_record, 'r_st') if paf else (TSV_COLS, tsv_record, 'pos')
+		self.out = open(outfile, 'w')
+		self.out.write("\t".join(self.cols + ['interesting']) + "\n")
+		self.num_contigs = 0
+		self.num_interesting = 0
+
+	def write(self, name, seq, hits):
+		if not hits:
+			return
+		self.num_contigs = self.num_contigs + 1
+		label = "False"
+		if num_aligned_parts(hits)>1:
+			self.num_interesting = self.num_interesting + 1
+			label = str(self.num_interesting)
+		for hit in sorted(hits, key=lambda h: h.r_st):
+			fields = self.record(name, seq, hit)
+			if self.record==paf_record:
+				fields[-1] = fields[-1].replace("\t", " ")
+			self.out.write("\t".join([str(f) for f in fields]) + "\t" + label + "\n")
+
+	def close(self):
+		self.out.close()
+
+def hit_writer(outfile, aligner, genome, preset=None, index_dir=None):
+	if str(outfile).endswith(".paf"):
+		return PafHitWriter(outfile)
+	if str(outfile).endswith(".bam"):
+		return BamHitWriter(outfile, aligner, genome, preset, index_dir)
+	return TsvHitWriter(outfile)
@@ -7,6 +7,7 @@ import pandas as pd
 import pysam
 import numpy as np
 
+from gemtools.bc_counts import count_window_bcs, LongCountWriter
 
 MIN_MAPQ = 0
 
@@ -21,19 +22,8 @@ def make_window(s,e,w):
 	new_end = e + adj_val
 	return [new_start,new_end]
 
-## DEFINE FUNCTION TO OBTAIN BARCODES FROM BAM FILE FOR SPECIFIC REGIONS
-
-def get_barcode_ids(bam_in, chrom, start, end, min_mapq):
-	bcs = []
-	for r in bam_in.fetch(chrom, start, end):
-	  if r.mapq >= min_mapq:
-		  if r.has_tag("BX"):
-			  bc_id=r.get_tag("BX")
-			  bcs.append(bc_id)
-	return list(bcs)
-
 #def count_bcs(sv_in, bam_file, full_w_size, small_w_size):
-def count_bcs(full_w_size=500000, small_w_size=1000,bc_subset='shared',sv_n="None",outpre="out",**kwargs):
+def count_bcs(full_w_size=500000, small_w_size=1000,bc_subset='shared',sv_n="None",outpre="out",long_format=False,**kwargs):
 
 	if 'in_window' in kwargs:
 		small_w_size = kwargs['in_window']
@@ -49,6 +39,8 @@ def count_bcs(full_w_size=500000, small_w_size=1000,bc_subset='shared',sv_n="Non
 		outpre = kwargs['out']
 	if 'shrd_file' in kwargs:
 		bc_input = kwargs['shrd_file']
+	if 'long' in kwargs:
+		long_format = kwargs['long']
 
 	full_w_size = int(full_w_size)  # -l #500000
 	small_w_size = int(small_w_size)
@@ -134,6 +126,11 @@ def count_bcs(full_w_size=500000, small_w_size=1000,bc_subset='shared',sv_n="Non
 
 	#print sv_df_full
 
+	bc_set = set(bc_list)
+	if long_format:
+		# long format: (window, barcode, count) rows of the barcodes with reads, written as each window is counted
+		long_out = LongCountWriter(str(outpre), ['id','name','chrom','window_start','window_end'], bc_list)
+
 	df_list = []
 	for index,row in sv_df_full.iterrows():
 
@@ -150,23 +147,25 @@ def count_bcs(full_w_size=500000, small_w_size=1000,bc_subset='shared',sv_n="Non
 		df_name['name'] = str(row['name'])
 		df_name = df_name[['id','name','chrom','window_start','window_end']]
 
-		# Make a list of barcodes in each of the 1kb windows
-		region_bcs = []
-		for i,r in df_name.iterrows():  
-			region_bc_list = get_barcode_ids(bam_open, r['chrom'], r['window_start'], r['window_end'], MIN_MAPQ)
-			region_bcs.append(region_bc_list)
-
+		# Count the reads of each SV-specific barcode in each of the 1kb windows
+		region_counts = []
+		for w in df_name.itertuples(index=False):
+			counts = count_window_bcs(bam_open, w.chrom, w.window_start, w.window_end, MIN_MAPQ, bc_set)
+			if long_format:
+				long_out.write(w, counts)
+			else:
+				region_counts.append(counts)
 
-		#bc_list = ast.literal_eval(row['bc_overlap_id'])
+		if not long_format:
+			for bc in bc_list:
+				df_name[bc] = [c[bc] for c in region_counts]
+			df_list.append(df_name)
 
-		# For each SV-specific barcode, count the number of times it occurs in each region
-		for bc in bc_list:
-			df_name[bc] = [x.count(bc) for x in region_bcs]
+	if long_format:
+		long_out.close()
+		return
 
-		df_list.append(df_name)
-		
 	# Write output to file
 	df_full = pd.concat(df_list)
 	df_full.to_csv(str(outpre), sep="\t", index=False)
 	return df_full
-
@@ -7,22 +7,12 @@ import pandas as pd
 import pysam
 import numpy as np
 
+from gemtools.bc_counts import count_window_bcs, LongCountWriter
 
 MIN_MAPQ = 0
 
-## DEFINE FUNCTION TO OBTAIN BARCODES FROM BAM FILE FOR SPECIFIC REGIONS
 
-def get_barcode_ids(bam_in, chrom, start, end, min_mapq):
-	bcs = []
-	for r in bam_in.fetch(chrom, start, end):
-	  if r.mapq >= min_mapq:
-		  if r.has_tag("BX"):
-			  bc_id=r.get_tag("BX")
-			  bcs.append(bc_id)
-	return list(bcs)
-
-
-def count_bcs_list(outpre='out',region_subset='None',small_w_size=1000,bc_subset='None',**kwargs):
+def count_bcs_list(outpre='out',region_subset='None',small_w_size=1000,bc_subset='None',long_format=False,**kwargs):
 
 	if 'region' in kwargs:
 		region_subset = kwargs['region']
@@ -34,6 +24,8 @@ def count_bcs_list(outpre='out',region_subset='None',small_w_size=1000,bc_subset
 		bc_subset = kwargs['bcs']
 	if 'out' in kwargs:
 		outpre = kwargs['out']
+	if 'long' in kwargs:
+		long_format = kwargs['long']
 
 	small_w_size = int(small_w_size)
 
@@ -73,16 +65,27 @@ def count_bcs_list(outpre='out',region_subset='None',small_w_size=1000,bc_subset
 	
 	df_r_out = pd.concat(df_r_list)
 
-	# Make a list of barcodes in each of the 1kb windows
-	
-	region_bcs = []
-	for i,r in df_r_out.iterrows():  
-		region_bc_list = get_barcode_ids(bam_open, r['chrom'], r['window_start'], r['window_end'], MIN_MAPQ)
-		region_bcs.append(region_bc_list)
+	# Count the reads of each barcode in each of the 1kb windows
+	# (long format: (window, barcode, count) rows of the barcodes with reads, written as each window is counted)
+
+	bc_set = set(bc_list)
+	if long_format:
+		long_out = LongCountWriter(str(outpre), ['chrom','window_start','window_end'], bc_list)
+
+	region_counts = []
+	for w in df_r_out.itertuples(index=False):
+		counts = count_window_bcs(bam_open, w.chrom, w.window_start, w.window_end, MIN_MAPQ, bc_set)
+		if long_format:
+			long_out.write(w, counts)
+		else:
+			region_counts.append(counts)
+
+	if long_format:
+		long_out.close()
+		return
 
-	# For each SV-specific barcode, count the number of times it occurs in each region
 	for bc in bc_list:
-		df_r_out[bc] = [x.count(bc) for x in region_bcs]
+		df_r_out[bc] = [c[bc] for c in region_counts]
 	
 	# Write output to file
 
@@ -0,0 +1,327 @@
+import os
+import sys
+import subprocess
+import string
+from array import array
+from collections import OrderedDict
+from itertools import groupby
+from multiprocessing.pool import ThreadPool
+from distutils.spawn import find_executable
+import numpy as np
+import pysam
+
+from gemtools.bc_matcher import BarcodeMatcher, BC_LEN
+from gemtools.fastq_pipeline import open_output
+
+## ON-DISK LAYOUT OF THE BARCODE INDEX OF A BAM (all files share the prefix, by default the bam path)
+##   <prefix>.bx.bcs.txt      one barcode (BX) per line; line number is the integer barcode id
+##   <prefix>.bx.offsets.npy  bins of barcode i are bins[offsets[i]:offsets[i+1]]
+##   <prefix>.bx.bins.npy     one row per (barcode, genomic bin): reference id (-1 = unplaced unmapped) and bin
+## a read belongs to the BIN_SIZE bin that contains its start position
+
+BIN_SIZE = 50000
+BIN_DTYPE = np.dtype([('tid','i4'),('bin','i4')])
+
+INDEX_SUFFIXES = ['.bx.bcs.txt','.bx.offsets.npy','.bx.bins.npy']
+
+MAX_BUFFERED = 500000
+WRITE_EVERY = 10000
+
+REVCOMP = string.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+
+class BxIndex(object):
+	"""Barcode -> genomic bins lookup table of a BAM file"""
+
+	def __init__(self, bcs, offsets, bins):
+		self.bcs = bcs
+		self.offsets = offsets
+		self.bins = bins
+		self.bc_array = np.array(bcs, dtype=str)
+
+	def intervals(self, bc_prefixes):
+		"""Merged (tid, start, end) intervals holding the reads of the barcodes whose 16-mer is in bc_prefixes"""
+		# barcodes are sorted, so the ones starting with a 16-mer are a run of ids, found by binary search
+		prefixes = np.array(sorted(bc_prefixes), dtype=str)
+		lo = np.searchsorted(self.bc_array, prefixes, side='left')
+		hi = np.searchsorted(self.bc_array, np.char.add(prefixes, "\xff"), side='left')
+		ids = [i for (l,h) in zip(lo, hi) for i in range(l, h)]
+		if not ids:
+			return []
+		bins = np.concatenate([self.bins[self.offsets[i]:self.offsets[i+1]] for i in ids])
+		keys = np.unique(bins['tid'].astype(np.int64)*(2**32) + bins['bin'])
+		tids = keys // (2**32)
+		bin_nums = keys % (2**32)
+
+		# consecutive bins of a reference are fetched as one interval
+		run_start = np.ones(len(keys), dtype=bool)
+		run_start[1:] = (tids[1:]!=tids[:-1]) | (bin_nums[1:]!=bin_nums[:-1]+1)
+		starts = np.nonzero(run_start)[0]
+		ends = np.append(starts[1:], len(keys)) - 1
+		return [(int(tids[s]), int(bin_nums[s])*BIN_SIZE, (int(bin_nums[e])+1)*BIN_SIZE) for s,e in zip(starts, ends)]
+
+	def save(self, prefix):
+		with open(prefix + ".bx.bcs.txt", 'w') as f:
+			for b in self.bcs:
+				f.write(str(b) + "\n")
+		np.save(prefix + ".bx.offsets.npy", np.asarray(self.offsets))
+		np.save(prefix + ".bx.bins.npy", np.asarray(self.bins))
+
+
+def bx_index_is_current(prefix, bam_input):
+	for s in INDEX_SUFFIXES:
+		if not os.path.isfile(prefix + s) or os.path.getmtime(prefix + s) < os.path.getmtime(bam_input):
+			return False
+	return True
+
+
+def load_bx_index(prefix):
+	"""Open an index written by build_bx_index(...).save(prefix); the arrays are memory-mapped, not read"""
+	for s in INDEX_SUFFIXES:
+		if not os.path.isfile(prefix + s):
+			raise IOError(str(prefix + s) + " does not exist")
+	with open(prefix + ".bx.bcs.txt") as f:
+		bcs = f.read().splitlines()
+	offsets = np.load(prefix + ".bx.offsets.npy", mmap_mode='r')
+	bins = np.load(prefix + ".bx.bins.npy", mmap_mode='r')
+	return BxIndex(bcs, offsets, bins)
+
+
+def build_bx_index(bam_input, nthreads=1):
+
+	bam_open = pysam.AlignmentFile(bam_input, 'rb', threads=nthreads)
+
+	bc_ids = {}
+	obs_bc = array('i')
+	obs_tid = array('i')
+	obs_bin = array('i')
+
+	# reads of a sorted bam arrive bin by bin, so barcodes are de-duplicated per bin as we go
+	cur_key = None
+	cur_bcs = set()
+	for r in bam_open.fetch(until_eof=True):
+		if r.is_secondary or r.is_supplementary or not r.has_tag("BX"):
+			continue
+		key = (r.reference_id, max(r.reference_start,0)//BIN_SIZE)
+		if key!=cur_key:
+			for i in cur_bcs:
+				obs_bc.append(i)
+				obs_tid.append(cur_key[0])
+				obs_bin.append(cur_key[1])
+			cur_key = key
+			cur_bcs = set()
+		bc = r.get_tag("BX")
+		i = bc_ids.get(bc)
+		if i is None:
+			i = bc_ids[bc] = len(bc_ids)
+		cur_bcs.add(i)
+	for i in cur_bcs:
+		obs_bc.append(i)
+		obs_tid.append(cur_key[0])
+		obs_bin.append(cur_key[1])
+	bam_open.close()
+
+	# renumber barcodes so that ids follow sorted barcode order
+	bcs_first_seen = sorted(bc_ids, key=bc_ids.get)
+	order = np.argsort(np.array(bcs_first_seen, dtype=object), kind='mergesort')
+	rank = np.empty(len(order), dtype=np.int64)
+	rank[order] = np.arange(len(order))
+	bcs = [bcs_first_seen[i] for i in order]
+
+	obs_bc = rank[np.array(obs_bc, dtype=np.int64)]
+	obs_tid = np.array(obs_tid, dtype=np.int64)
+	obs_bin = np.array(obs_bin, dtype=np.int64)
+
+	# one row per (barcode, tid, bin), grouped by barcode
+	order = np.lexsort((obs_bin, obs_tid, obs_bc))
+	obs_bc = obs_bc[order]
+	obs_tid = obs_tid[order]
+	obs_bin = obs_bin[order]
+	first = np.ones(len(order), dtype=bool)
+	first[1:] = (obs_bc[1:]!=obs_bc[:-1]) | (obs_tid[1:]!=obs_tid[:-1]) | (obs_bin[1:]!=obs_bin[:-1])
+
+	bins = np.zeros(int(first.sum()), dtype=BIN_DTYPE)
+	bins['tid'] = obs_tid[first]
+	bins['bin'] = obs_bin[first]
+	offsets = np.searchsorted(obs_bc[first], np.arange(len(bcs)+1)).astype(np.int64)
+
+	return BxIndex(bcs, offsets, bins)
+
+
+def fastq_record(name, bx, seq, qual):
+	return "@" + name + " BX:Z:" + bx + "\n" + seq + "\n+\n" + qual + "\n"
+
+
+class MatePairer(object):
+	"""Pairs read 1 and read 2 by name; at most max_buffered unpaired reads are held in memory,
+	older ones are spilled to a file that is sorted by name and paired at the end"""
+
+	def __init__(self, out_r1, out_r2, bc_matcher, spill_path, max_buffered=MAX_BUFFERED):
+		self.out_r1 = out_r1
+		self.out_r2 = out_r2
+		self.bc_matcher = bc_matcher
+		self.spill_path = spill_path
+		self.spill = None
+		self.max_buffered = max_buffered
+		self.buffer = OrderedDict()
+		self.r1_chunks = []
+		self.r2_chunks = []
+		self.pairs = 0
+		self.unpaired = 0
+
+	def add(self, name, is_read1, bx, seq, qual):
+		mate = self.buffer.pop(name, None)
+		if mate is None:
+			self.buffer[name] = (is_read1, bx, seq, qual)
+			if len(self.buffer) > self.max_buffered:
+				self.spill_read(*self.buffer.popitem(last=False))
+		elif mate[0]!=is_read1:
+			if is_read1:
+				self.emit(name, (is_read1, bx, seq, qual), mate)
+			else:
+				self.emit(name, mate, (is_read1, bx, seq, qual))
+		else:
+			self.buffer[name] = mate
+			self.unpaired = self.unpaired + 1
+
+	def emit(self, name, read1, read2):
+		self.r1_chunks.append(fastq_record(name, read1[1], read1[2], read1[3]))
+		self.r2_chunks.append(fastq_record(name, read2[1], read2[2], read2[3]))
+		self.bc_matcher.match(read1[1])
+		self.pairs = self.pairs + 1
+		if len(self.r1_chunks) >= WRITE_EVERY:
+			self.flush()
+
+	def flush(self):
+		self.out_r1.write("".join(self.r1_chunks))
+		self.out_r2.write("".join(self.r2_chunks))
+		self.r1_chunks = []
+		self.r2_chunks = []
+
+	def spill_read(self, name, read):
+		if self.spill is None:
+			self.spill = open(self.spill_path, 'w')
+		self.spill.write("\t".join([name, str(int(read[0])), read[1], read[2], read[3]]) + "\n")
+
+	def finish(self):
+		# reads still waiting for their mate are paired from the name-sorted spill file (if anything was spilled)
+		if self.spill is None:
+			self.unpaired = self.unpaired + len(self.buffer)
+			self.buffer = OrderedDict()
+		else:
+			while self.buffer:
+				self.spill_read(*self.buffer.popitem(last=False))
+			self.spill.close()
+			for name,group in groupby(sorted_lines(self.spill_path), key=lambda line: line.split("\t",1)[0]):
+				reads = [line.rstrip("\n").split("\t") for line in group]
+				read1 = [r for r in reads if r[1]=="1"]
+				read2 = [r for r in reads if r[1]=="0"]
+				if read1 and read2:
+					self.emit(name, (True,)+tuple(read1[0][2:5]), (False,)+tuple(read2[0][2:5]))
+				self.unpaired = self.unpaired + len(reads) - 2*int(bool(read1 and read2))
+			os.remove(self.spill_path)
+		self.flush()
+
+
+def sorted_lines(path):
+	if find_executable("sort"):
+		env = dict(os.environ)
+		env['LC_ALL'] = "C"
+		proc = subprocess.Popen(["sort", "-t", "\t", "-k1,1", "-T", os.path.dirname(os.path.abspath(path)), path], stdout=subprocess.PIPE, env=env)
+		for line in proc.stdout:
+			yield line
+		if proc.wait()!=0:
+			raise IOError("failed to sort " + str(path))
+	else:
+		with open(path) as f:
+			for line in sorted(f, key=lambda line: line.split("\t",1)[0]):
+				yield line
+
+
+def extract_reads_bam(index_prefix='None',nthreads=3,compress_level=6,**kwargs):
+
+	if 'bam' in kwargs:
+		bam_input = kwargs['bam']
+	if 'bcs' in kwargs:
+		bc_file = kwargs['bcs']
+	if 'fq_outdir' in kwargs:
+		out_dir = kwargs['fq_outdir']
+	if 'bx_index' in kwargs:
+		index_prefix = kwargs['bx_index']
+	if 'nthreads' in kwargs:
+		nthreads = kwargs['nthreads']
+	if 'compress_level' in kwargs:
+		compress_level = kwargs['compress_level']
+
+	if str(index_prefix)=="None":
+		index_prefix = str(bam_input)
+
+	if not out_dir.endswith("/"):
+		out_dir = out_dir + "/"
+
+	sample_name = str(bam_input).split("/")[-1]
+	if sample_name.endswith(".bam"):
+		sample_name = sample_name[:-4]
+	out_r1 = out_dir + sample_name + "_R1.fastq" + (".gz" if int(compress_level)>0 else "")
+	out_r2 = out_dir + sample_name + "_R2.fastq" + (".gz" if int(compress_level)>0 else "")
+
+	for f in [out_r1, out_r2]:
+		if os.path.isfile(f):
+			print str(f) + " already exists"
+			sys.exit()
+
+	bam_open = pysam.AlignmentFile(bam_input, 'rb', threads=nthreads)
+	if not bam_open.has_index():
+		print str(bam_input) + " must be indexed (samtools index) -- exiting"
+		sys.exit(1)
+
+	# the barcode index is built on first use and reused until the bam changes
+	if bx_index_is_current(index_prefix, bam_input):
+		bx_index = load_bx_index(index_prefix)
+	else:
+		print >>sys.stderr, "Building barcode index " + index_prefix + ".bx.*"
+		bx_index = build_bx_index(bam_input, nthreads)
+		bx_index.save(index_prefix)
+
+	bc_matcher = BarcodeMatcher(bc_file)
+	intervals = bx_index.intervals(bc_matcher.lookup)
+
+	if not os.path.isdir(out_dir):
+		os.makedirs(out_dir)
+
+	pool = ThreadPool(max(1,int(nthreads)))
+	out_r1_file = open_output(out_r1, compress_level, pool)
+	out_r2_file = open_output(out_r2, compress_level, pool)
+	pairer = MatePairer(out_r1_file, out_r2_file, bc_matcher, out_dir + sample_name + ".unpaired.tmp")
+
+	lookup = bc_matcher.lookup
+	for (tid, start, end) in intervals:
+		if tid<0:
+			reads = bam_open.fetch(region="*")
+		else:
+			reads = bam_open.fetch(bam_open.get_reference_name(tid), start, end)
+		for r in reads:
+			# a read starting before the interval belongs to (and was written with) an earlier bin
+			if tid>=0 and r.reference_start < start:
+				continue
+			if r.is_secondary or r.is_supplementary or not r.has_tag("BX"):
+				continue
+			bx = r.get_tag("BX")
+			if bx[0:BC_LEN] not in lookup:
+				continue
+			seq = r.query_sequence
+			qual = pysam.qualities_to_qualitystring(r.query_qualities) if r.query_qualities is not None else "I"*len(seq)
+			if r.is_reverse:
+				seq = seq.translate(REVCOMP)[::-1]
+				qual = qual[::-1]
+			pairer.add(r.query_name, r.is_read1, bx, seq, qual)
+
+	pairer.finish()
+	bam_open.close()
+	out_r1_file.close()
+	out_r2_file.close()
+	pool.close()
+	pool.join()
+
+	bc_matcher.write_counts(out_dir + "bc_match_counts.txt")
+	print "%d read pairs written from %d bam intervals; %d reads without a mate; %d of %d barcodes found" % (pairer.pairs, len(intervals), pairer.unpaired, bc_matcher.num_matched_bcs(), len(bc_matcher.bcs))
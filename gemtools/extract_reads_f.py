@@ -5,8 +5,13 @@ import sys
 import time
 from itertools import izip_longest, islice
 import io
+from multiprocessing.pool import ThreadPool
 
-def extract_reads(**kwargs):	
+from gemtools.bc_matcher import BarcodeMatcher, BarcodeSetMatcher
+from gemtools.fastq_pipeline import run_extraction, run_demux, output_path, open_output, OutputPool
+from gemtools.checkpoint import input_signature, read_checkpoint, write_checkpoint, truncate_outputs
+
+def extract_reads(nthreads=3,compress_level=6,to_stdout=False,out_dir='None',manifest='None',max_open=100,resume=False,bc_correct=False,**kwargs):	
 
 	if 'read1' in kwargs:
 		r1 = kwargs['read1']
@@ -18,65 +23,137 @@ def extract_reads(**kwargs):
 		bc_file = kwargs['bcs']
 	if 'fq_outdir' in kwargs:
 		out_dir = kwargs['fq_outdir']
-	
+	if 'nthreads' in kwargs:
+		nthreads = kwargs['nthreads']
+	if 'compress_level' in kwargs:
+		compress_level = kwargs['compress_level']
+	if 'stdout' in kwargs:
+		to_stdout = kwargs['stdout']
+	if 'manifest' in kwargs:
+		manifest = kwargs['manifest']
+	if 'max_open' in kwargs:
+		max_open = kwargs['max_open']
+	if 'resume' in kwargs:
+		resume = kwargs['resume']
+	if 'bc_correct' in kwargs:
+		bc_correct = kwargs['bc_correct']
+
+	if str(manifest)!="None":
+		extract_read_sets(r1, r2, i1, manifest, out_dir, nthreads, compress_level, max_open, bc_correct)
+		return
+
+	bc_matcher = BarcodeMatcher(bc_file)
+	if bc_correct:
+		bc_matcher.enable_correction()
+
+	if to_stdout:
+		# stream R1/R2 records interleaved and uncompressed, e.g. into an assembler; the summary goes to stderr
+		(n, i) = run_extraction([r1, r2], [4,4], [sys.stdout], bc_matcher.select, threads=nthreads, interleave=True)
+		sys.stdout.flush()
+		if str(out_dir)!="None":
+			if not os.path.isdir(out_dir):
+				os.makedirs(out_dir)
+			bc_matcher.write_counts(os.path.join(str(out_dir), "bc_match_counts.txt"))
+		print >>sys.stderr, "%d reads processed, %d records matched bcs; %d of %d barcodes found" % (n, i, bc_matcher.num_matched_bcs(), len(bc_matcher.bcs)) + bc_matcher.correction_summary()
+		return
+
 	if not out_dir.endswith("/"):
 		out_dir = out_dir + "/"
 	
-	out_r1 = str(out_dir) + str(r1.split("/")[-1])
-	out_r2 = str(out_dir) + str(r2.split("/")[-1])
-	out_i1 = str(out_dir) + str(i1.split("/")[-1])
-	
-	if os.path.isfile(out_r1):
-		print str(out_r1) + " already exists"
-		sys.exit()
-	
-	if os.path.isfile(out_r2):
-		print str(out_r2) + " already exists"
-		sys.exit()
+	out_r1 = output_path(out_dir, r1, compress_level)
+	out_r2 = output_path(out_dir, r2, compress_level)
+	out_i1 = output_path(out_dir, i1, compress_level)
+	out_files = [out_r1, out_r2, out_i1]
+	checkpoint_file = str(out_dir) + "extract_reads.checkpoint.json"
+	inputs = [input_signature(f) for f in [r1, r2, i1]]
 
-	if os.path.isfile(out_i1):
-		print str(out_i1) + " already exists"
-		sys.exit()
+	# resuming: outputs are cut back to the last checkpoint and appended to, and the records it covers are skipped
+	skip = 0
+	matched = 0
+	if resume and os.path.isfile(checkpoint_file):
+		state = read_checkpoint(checkpoint_file)
+		if state['inputs']!=inputs or state['compress_level']!=int(compress_level) or state['bcs']!=bc_matcher.bcs or state['bc_correct']!=bool(bc_correct):
+			print str(checkpoint_file) + " was written for different inputs, barcodes or compression level -- exiting"
+			sys.exit(1)
+		truncate_outputs(out_files, state['output_sizes'])
+		skip = state['records']
+		matched = state['matched']
+		bc_matcher.counts = state['bc_counts']
+		if bc_correct:
+			bc_matcher.corrected_counts = state['corrected_counts']
+		print >>sys.stderr, "Resuming after %d reads (%d records matched)" % (skip, matched)
+	else:
+		if resume:
+			print >>sys.stderr, "No checkpoint in " + str(out_dir) + " -- starting from the beginning"
+		for f in out_files:
+			if os.path.isfile(f) and not resume:
+				print str(f) + " already exists"
+				sys.exit()
 
 	if not os.path.isdir(out_dir):
 		os.makedirs(out_dir)
 	
-	out_r1_file = gzip.open(out_r1,'w')
-	out_r2_file = gzip.open(out_r2,'w')
-	out_si_file = gzip.open(out_i1,'w')
-
-	bcs_list = []
-	with open(bc_file,'r') as f:
-		for line in csv.reader(f,delimiter='\t'):
-			bcs_list.append(line[0])
-
-	bcs_set = set(bcs_list)
-	bcs_set = [b.split("-")[0] for b in bcs_set]
-
-	n = 0
-	i = 0
-
-	with io.BufferedReader(gzip.open(r1, 'r')) as f1, io.BufferedReader(gzip.open(r2, 'r')) as f2, io.BufferedReader(gzip.open(i1,'r')) as ind:
-		cur_time = time.time()
-		while True:
-			lines_r1 = list(islice(f1,4))
-			lines_r2 = list(islice(f2,4))
-			lines_index = list(islice(ind,4))
-
-			if not lines_r1:
-				break
-
-			n = n + 1
-			if (n % 1000000 == 0):
-				print >>sys.stderr, "%d reads processed, %d records matched bcs in a %d second chunk" % (n, i, time.time() - cur_time)
-				cur_time = time.time()
-
-			if (lines_r1[1][0:16] in bcs_set):
-				i = i + 1
-
-				for line in lines_r1:
-					out_r1_file.write(line)
-				for line in lines_r2:
-					out_r2_file.write(line)
-				for line in lines_index:
-					out_si_file.write(line)
+	# BGZF blocks of all three outputs are compressed by one shared pool of threads
+	pool = ThreadPool(max(1,int(nthreads)))
+	out_r1_file = open_output(out_r1, compress_level, pool, append=skip>0)
+	out_r2_file = open_output(out_r2, compress_level, pool, append=skip>0)
+	out_si_file = open_output(out_i1, compress_level, pool, append=skip>0)
+
+	def checkpoint(n, i, output_sizes):
+		write_checkpoint(checkpoint_file, {'inputs': inputs, 'compress_level': int(compress_level), 'bcs': bc_matcher.bcs, 'bc_correct': bool(bc_correct),
+			'records': skip + n, 'matched': matched + i, 'output_sizes': output_sizes, 'bc_counts': bc_matcher.counts, 'corrected_counts': bc_matcher.corrected_counts})
+
+	# R1, R2 and I1 are each inflated by their own worker; records are matched on the R1 barcode in batches
+	(n, i) = run_extraction([r1, r2, i1], [4,4,4], [out_r1_file, out_r2_file, out_si_file], bc_matcher.select, threads=nthreads, skip_records=skip, checkpoint=checkpoint)
+	n = n + skip
+	i = i + matched
+
+	out_r1_file.close()
+	out_r2_file.close()
+	out_si_file.close()
+	pool.close()
+	pool.join()
+
+	bc_matcher.write_counts(str(out_dir) + "bc_match_counts.txt")
+	if os.path.isfile(checkpoint_file):
+		os.remove(checkpoint_file)
+	print "%d reads processed, %d records matched bcs; %d of %d barcodes found" % (n, i, bc_matcher.num_matched_bcs(), len(bc_matcher.bcs)) + bc_matcher.correction_summary()
+
+def extract_read_sets(r1, r2, i1, manifest, out_dir, nthreads=3, compress_level=6, max_open=100, bc_correct=False):
+	# demultiplexing: one pass over the library, each matching read is written to every set that has its barcode
+
+	bc_matcher = BarcodeSetMatcher(manifest)
+	if bc_correct:
+		bc_matcher.enable_correction()
+
+	if not out_dir.endswith("/"):
+		out_dir = out_dir + "/"
+
+	set_dirs = [str(out_dir) + str(name).replace("/","_") + "/" for name in bc_matcher.set_names]
+	inputs = [r1, r2, i1]
+
+	for d in set_dirs:
+		for f in inputs:
+			if os.path.isfile(output_path(d, f, compress_level)):
+				print str(output_path(d, f, compress_level)) + " already exists"
+				sys.exit()
+
+	for d in set_dirs:
+		if not os.path.isdir(d):
+			os.makedirs(d)
+
+	pool = ThreadPool(max(1,int(nthreads)))
+
+	def open_set_output(key, append):
+		(s, j) = key
+		return open_output(output_path(set_dirs[s], inputs[j], compress_level), compress_level, pool, append)
+
+	out_pool = OutputPool(open_set_output, max_open)
+	(n, i) = run_demux(inputs, [4,4,4], out_pool, bc_matcher.route, threads=nthreads)
+	out_pool.close_all([(s,j) for s in range(len(set_dirs)) for j in range(len(inputs))])
+	pool.close()
+	pool.join()
+
+	bc_matcher.write_counts(str(out_dir) + "bc_match_counts.txt")
+	bc_matcher.write_set_counts(str(out_dir) + "set_match_counts.txt")
+	print "%d reads processed, %d records matched bcs; %d of %d barcodes found; reads written to %d sets" % (n, i, bc_matcher.num_matched_bcs(), len(bc_matcher.bcs), len(set_dirs)) + bc_matcher.correction_summary()
@@ -7,8 +7,16 @@ from itertools import izip_longest, islice
 import gzip
 import time
 import io
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
-def extract_reads_interleaved(**kwargs):
+from gemtools.bc_matcher import BarcodeMatcher
+from gemtools.fastq_pipeline import run_extraction, output_path, open_output
+
+## the barcode matcher is a module global so that forked workers share the parent's copy
+BC_MATCHER = None
+
+def extract_reads_interleaved(nthreads=3,nprocs=1,compress_level=6,to_stdout=False,out_dir='None',bc_correct=False,**kwargs):
 
 	if 'fqdir' in kwargs:
 		fq_path = kwargs['fqdir']
@@ -20,13 +28,24 @@ def extract_reads_interleaved(**kwargs):
 		bc_file = kwargs['bcs']
 	if 'fq_outdir' in kwargs:
 		out_dir = kwargs['fq_outdir']
-
-	if os.path.isdir(out_dir):
-		print str(out_dir) + " already exists -- exiting"
-		sys.exit()
-
-	if not os.path.isdir(out_dir):
-		os.makedirs(out_dir)
+	if 'nthreads' in kwargs:
+		nthreads = kwargs['nthreads']
+	if 'nprocs' in kwargs:
+		nprocs = kwargs['nprocs']
+	if 'compress_level' in kwargs:
+		compress_level = kwargs['compress_level']
+	if 'stdout' in kwargs:
+		to_stdout = kwargs['stdout']
+	if 'bc_correct' in kwargs:
+		bc_correct = kwargs['bc_correct']
+
+	if str(out_dir)!="None":
+		if os.path.isdir(out_dir):
+			print str(out_dir) + " already exists -- exiting"
+			sys.exit()
+
+		if not os.path.isdir(out_dir):
+			os.makedirs(out_dir)
         
         bc_list = bcs.split(",")
 
@@ -35,6 +54,13 @@ def extract_reads_interleaved(**kwargs):
              
         file_list = os.listdir(fq_path) #list of things in directory
 
+        global BC_MATCHER
+        BC_MATCHER = BarcodeMatcher(bc_file) #loaded once, shared by all files
+        if bc_correct:
+                BC_MATCHER.enable_correction()
+
+        pair_list = []
+
         for bc in bc_list: #for each barcode
                 bc_files = [f for f in file_list if bc in f]
 
@@ -43,59 +69,72 @@ def extract_reads_interleaved(**kwargs):
                         ra_file = [r for r in lane_files if 'read-RA' in r][0]
                         i_file = [i for i in lane_files if 'read-I1' in i][0]
 
-                        if not out_dir.endswith("/"):
+                        if str(out_dir)!="None" and not out_dir.endswith("/"):
                                 out_dir = out_dir + "/"
 
                         if not fq_path.endswith("/"):
                                 fq_path = fq_path + "/"
 
-                        cmd_list = [fq_path + ra_file, fq_path + i_file, bc_file, out_dir + ra_file, out_dir + i_file]
-
-                        extract_reads(cmd_list)
-
-
-def extract_reads(args_fq):
-
-        bcs = [] 
-
-        out_file = io.BufferedWriter(gzip.open(args_fq[3],'w')) 
-        out_si_file = io.BufferedWriter(gzip.open(args_fq[4],'w'))
-
-        with open(args_fq[2],'r') as f:
-                for line in csv.reader(f,delimiter='\t'): 
-                        bcs.append(line[0])
-
-        bcs = set(bcs)
-        bcs = [b.split("-")[0] for b in bcs]
-
-        n = 0
-        i = 0
-
-        with io.BufferedReader(gzip.open(args_fq[0], 'r')) as f, io.BufferedReader(gzip.open(args_fq[1],'r')) as ind:
-                cur_time = time.time()
-
-                while True:
-                        lines = list(islice(f,8)) #slice after index 8 of fastq
-                        lines_index = list(islice(ind,4)) #slice after index 4 of si_fastq (file of indices)
-
-                        if not lines:
-                                break
-
-                        n = n + 1
-                        if (n % 1000000 == 0): 
-                                print >>sys.stderr, "%d reads processed, %d records matched bcs in a %d second chunk" % (n, i, time.time() - cur_time)
-                                cur_time = time.time()
-
-                        if (lines[1][0:16] in bcs): #if barcodes match
-                                i = i + 1
-
-                                for line in lines:
-                                        out_file.write(line)
-                                for line in lines_index:
-                                        out_si_file.write(line)
-
-        
-
-
-                       
-                   
+                        if to_stdout:
+                                cmd_list = [fq_path + ra_file, fq_path + i_file, bc_file, None, None]
+                        else:
+                                cmd_list = [fq_path + ra_file, fq_path + i_file, bc_file, output_path(out_dir, ra_file, compress_level), output_path(out_dir, i_file, compress_level)]
+
+                        pair_list.append((cmd_list, nthreads, compress_level))
+
+        # each (sample barcode, lane) RA/I1 pair is independent -- extract them concurrently
+        # (except when streaming to stdout, where the RA records of the pairs are written one pair after the other)
+        if int(nprocs)>1 and not to_stdout:
+                pool = multiprocessing.Pool(min(int(nprocs), len(pair_list)))
+                pair_results = pool.map(extract_pair, pair_list, chunksize=1)
+                pool.close()
+                pool.join()
+        else:
+                pair_results = [extract_pair(p) for p in pair_list]
+
+        # aggregate per-barcode counts over all files
+        BC_MATCHER.counts = [sum(c) for c in zip(*[r[3][0] for r in pair_results])]
+        if bc_correct:
+                BC_MATCHER.corrected_counts = [sum(c) for c in zip(*[r[3][1] for r in pair_results])]
+        if str(out_dir)!="None":
+                BC_MATCHER.write_counts(out_dir + "bc_match_counts.txt")
+
+        log = sys.stderr if to_stdout else sys.stdout
+        print >>log, "file\treads_processed\treads_matched"
+        for (ra_file,n,i,counts) in pair_results:
+                print >>log, "%s\t%d\t%d" % (ra_file.split("/")[-1], n, i)
+        print >>log, "total\t%d\t%d" % (sum([r[1] for r in pair_results]), sum([r[2] for r in pair_results]))
+        print >>log, "%d of %d barcodes found" % (BC_MATCHER.num_matched_bcs(), len(BC_MATCHER.bcs)) + BC_MATCHER.correction_summary()
+
+
+def extract_pair(pair_args):
+        (cmd_list, nthreads, compress_level) = pair_args
+
+        # counts are per pair here; the parent sums them
+        BC_MATCHER.counts = [0]*len(BC_MATCHER.bcs)
+        if BC_MATCHER.corrected_counts is not None:
+                BC_MATCHER.corrected_counts = [0]*len(BC_MATCHER.bcs)
+        (n, i) = extract_reads(cmd_list, BC_MATCHER, nthreads, compress_level)
+        return (cmd_list[0], n, i, (BC_MATCHER.counts, BC_MATCHER.corrected_counts))
+
+
+def extract_reads(args_fq, bc_matcher, nthreads=3, compress_level=6):
+
+        if args_fq[3] is None:
+                # stdout streaming: only the (already interleaved) RA records, uncompressed
+                (n, i) = run_extraction([args_fq[0]], [8], [sys.stdout], bc_matcher.select, threads=nthreads)
+                sys.stdout.flush()
+                return (n, i)
+
+        pool = ThreadPool(max(1,int(nthreads)))
+        out_file = open_output(args_fq[3], compress_level, pool)
+        out_si_file = open_output(args_fq[4], compress_level, pool)
+
+        # RA records are 8 lines (read 1 + read 2), I1 records 4 lines; the barcode starts read 1 of RA
+        (n, i) = run_extraction([args_fq[0], args_fq[1]], [8,4], [out_file, out_si_file], bc_matcher.select, threads=nthreads)
+
+        out_file.close()
+        out_si_file.close()
+        pool.close()
+        pool.join()
+        return (n, i)
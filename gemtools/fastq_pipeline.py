@@ -0,0 +1,354 @@
+import os
+import sys
+import io
+import gzip
+import time
+import threading
+import subprocess
+from Queue import Queue
+from collections import OrderedDict
+from distutils.spawn import find_executable
+import numpy as np
+
+from gemtools.bgzf_writer import BgzfWriter
+from gemtools.bc_matcher import BC_LEN
+
+## PIPELINED FASTQ EXTRACTION
+##   reader (one thread per input, inflating in a pigz/gzip child process when available)
+##     -> bounded queue of record batches -> matcher (caller thread)
+##     -> bounded queue of output chunks -> writer (one thread per output)
+## queues hold at most QUEUE_SIZE batches, so memory is capped regardless of input size
+## inputs are read in BUFFER_SIZE blocks; record boundaries are found by locating the newlines of a block at once
+## (numpy), so reads are never split into lines; a batch is BATCH_SIZE whole records as one string, with the
+## offsets of its records -- barcodes are sliced out of it, and kept records are copied out as whole slices
+## outputs are written once per batch, as BGZF compressed by a shared thread pool (or uncompressed at level 0)
+## in demultiplexing mode, records are routed to the output files of every barcode set they belong to
+
+BUFFER_SIZE = 4*1024*1024
+BATCH_SIZE = 20000
+QUEUE_SIZE = 4
+REPORT_EVERY = 1000000
+CHECKPOINT_SECONDS = 300
+
+def inflater_cmd(threads):
+	if find_executable("pigz"):
+		return ["pigz", "-dc", "-p", str(max(1,int(threads)))]
+	if find_executable("gzip"):
+		return ["gzip", "-dc"]
+	return None
+
+class FastqInput(object):
+
+	def __init__(self, path, threads=1):
+		self.path = path
+		self.proc = None
+		cmd = inflater_cmd(threads) if str(path).endswith(".gz") else None
+		if cmd:
+			self.proc = subprocess.Popen(cmd + [path], stdout=subprocess.PIPE, bufsize=-1)
+			self.handle = self.proc.stdout
+		elif str(path).endswith(".gz"):
+			self.handle = io.BufferedReader(gzip.open(path,'rb'))
+		else:
+			self.handle = open(path,'rb')
+
+	def close(self):
+		self.handle.close()
+		if self.proc is not None and self.proc.wait()!=0:
+			raise IOError("failed to decompress " + str(self.path))
+
+class StageError(object):
+	# carries an exception raised in a reader/writer thread back to the matcher
+	def __init__(self, exc_info):
+		self.exc_info = exc_info
+
+	def reraise(self):
+		raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+def newlines(data):
+	return np.flatnonzero(np.frombuffer(data, dtype=np.uint8)==10)
+
+class RecordBatch(object):
+	# whole records as one string, with the offsets of their newlines; record k is data[starts[k]:ends[k]], and its
+	# 2nd line starts at seq_starts[k]
+
+	def __init__(self, data, nl, lines_per_record):
+		self.data = data
+		self.ends = nl[lines_per_record-1::lines_per_record] + 1
+		self.starts = np.append(0, self.ends[:-1])
+		self.seq_starts = nl[0::lines_per_record] + 1
+
+	def __len__(self):
+		return len(self.ends)
+
+	def barcodes(self):
+		# the first BC_LEN bases of the 2nd line (sequence) of every record, gathered at once
+		buf = np.frombuffer(self.data, dtype=np.uint8)
+		pos = np.minimum(self.seq_starts[:,None] + np.arange(BC_LEN), len(buf)-1)
+		return buf[pos].view('S%d' % BC_LEN).ravel().tolist()
+
+	def record_list(self, keep):
+		data = self.data
+		return [data[s:e] for (s,e) in zip(self.starts[keep].tolist(), self.ends[keep].tolist())]
+
+	def records(self, keep):
+		return "".join(self.record_list(keep))
+
+def split_records(fq_input, lines_per_record):
+	# yields (block, offsets of the newlines of the whole records in the block); a record cut by the end of a
+	# block is completed by the next one
+	tail = ""
+	while True:
+		buf = fq_input.handle.read(BUFFER_SIZE)
+		if not buf:
+			break
+		data = tail + buf
+		nl = newlines(data)
+		nl = nl[:len(nl) - len(nl) % lines_per_record]
+		tail = data[int(nl[-1])+1:] if len(nl) else data
+		yield (data, nl)
+	if tail:
+		if not tail.endswith("\n"):
+			tail = tail + "\n"
+		nl = newlines(tail)
+		if len(nl) % lines_per_record != 0:
+			raise IOError("truncated fastq record at the end of " + str(fq_input.path))
+		yield (tail, nl)
+
+def read_batches(fq_input, lines_per_record, batch_size, queue, skip_records=0):
+	try:
+		# whole records of the batch being filled: their text and newline offsets (within the batch)
+		pending = []
+		pending_nl = []
+		size = 0
+		num_pending = 0
+		for (data, nl) in split_records(fq_input, lines_per_record):
+			start = 0
+			if skip_records>0:
+				# records already processed by the run being resumed
+				skipped = min(skip_records, len(nl)//lines_per_record)
+				if skipped:
+					start = int(nl[skipped*lines_per_record-1]) + 1
+				nl = nl[skipped*lines_per_record:]
+				skip_records = skip_records - skipped
+			while len(nl):
+				take = min(batch_size - num_pending, len(nl)//lines_per_record)
+				piece_nl = nl[:take*lines_per_record]
+				end = int(piece_nl[-1]) + 1
+				pending.append(data[start:end])
+				pending_nl.append(piece_nl - start + size)
+				size = size + end - start
+				num_pending = num_pending + take
+				start = end
+				nl = nl[take*lines_per_record:]
+				if num_pending==batch_size:
+					queue.put(RecordBatch("".join(pending), np.concatenate(pending_nl), lines_per_record))
+					(pending, pending_nl, size, num_pending) = ([], [], 0, 0)
+
+		if skip_records>0:
+			raise IOError(str(fq_input.path) + " has fewer records than the checkpoint")
+		if pending:
+			queue.put(RecordBatch("".join(pending), np.concatenate(pending_nl), lines_per_record))
+		fq_input.close()
+		queue.put(None)
+	except Exception:
+		queue.put(StageError(sys.exc_info()))
+
+class CheckpointMark(object):
+	# sent down the output queues; each writer ends its current block and reports the size of its output,
+	# so the sizes are consistent with the records queued before the mark
+
+	def __init__(self, num_outputs):
+		self.sizes = [None]*num_outputs
+		self.pending = num_outputs
+		self.lock = threading.Lock()
+		self.done = threading.Event()
+
+	def record(self, j, size):
+		with self.lock:
+			self.sizes[j] = size
+			self.pending = self.pending - 1
+			if self.pending==0:
+				self.done.set()
+
+def write_batches(out_handle, queue, errors, j=0):
+	while True:
+		chunk = queue.get()
+		if chunk is None:
+			break
+		if isinstance(chunk, CheckpointMark):
+			try:
+				if not errors:
+					out_handle.flush()
+					os.fsync(out_handle.fileno())
+				chunk.record(j, os.fstat(out_handle.fileno()).st_size)
+			except Exception:
+				errors.append(StageError(sys.exc_info()))
+				chunk.record(j, None)
+			continue
+		if errors:
+			continue # keep draining so the matcher never blocks
+		try:
+			out_handle.write(chunk)
+		except Exception:
+			errors.append(StageError(sys.exc_info()))
+
+def output_path(out_dir, in_path, level):
+	# outputs keep the input file name; uncompressed outputs drop the .gz suffix
+	name = str(in_path).split("/")[-1]
+	if int(level)==0 and name.endswith(".gz"):
+		name = name[:-3]
+	return str(out_dir) + name
+
+def open_output(path, level=6, pool=None, append=False):
+	if int(level)>0:
+		return BgzfWriter(path, level, pool, 'ab' if append else 'wb')
+	return io.BufferedWriter(io.FileIO(path,'a' if append else 'w'), BUFFER_SIZE)
+
+def start_thread(target, args):
+	t = threading.Thread(target=target, args=args)
+	t.daemon = True
+	t.start()
+	return t
+
+def lockstep_batches(inputs, lines_per_record, threads=1, batch_size=BATCH_SIZE, skip_records=0):
+	# yields one batch (RecordBatch) per input at a time, checking that the inputs stay in step
+	in_queues = [Queue(QUEUE_SIZE) for i in inputs]
+	for path,lpr,q in zip(inputs, lines_per_record, in_queues):
+		start_thread(read_batches, (FastqInput(path, threads), lpr, batch_size, q, skip_records))
+
+	while True:
+		batches = [q.get() for q in in_queues]
+		for b in batches:
+			if isinstance(b, StageError):
+				b.reraise()
+		if batches[0] is None:
+			if any(b is not None for b in batches):
+				raise IOError("fastq files do not have the same number of records: " + ", ".join(inputs))
+			break
+
+		if None in batches or len(set([len(b) for b in batches]))>1:
+			raise IOError("fastq files do not have the same number of records: " + ", ".join(inputs))
+		yield batches
+
+def report_progress(n, i, num_records, num_kept, cur_time):
+	if (n + num_records)//REPORT_EVERY > n//REPORT_EVERY:
+		print >>sys.stderr, "%d reads processed, %d records matched bcs in a %d second chunk" % (n + num_records, i + num_kept, time.time() - cur_time)
+		return time.time()
+	return cur_time
+
+def run_extraction(inputs, lines_per_record, outputs, select, threads=1, batch_size=BATCH_SIZE, interleave=False, skip_records=0, checkpoint=None):
+	# inputs are read in lockstep; select(barcodes) returns the indices of the records to keep, where barcodes
+	# are the first BC_LEN bases of the 2nd line (sequence) of each record of the first input
+	# with interleave, outputs is a single handle that gets each kept record of every input in turn
+	# the first skip_records records are skipped; every CHECKPOINT_SECONDS, checkpoint(n, i, output_sizes) is called
+	# with the records processed/matched so far (after the skipped ones) and the output sizes that hold them
+	out_queues = [Queue(QUEUE_SIZE) for o in outputs]
+	errors = []
+	writers = [start_thread(write_batches, (o, q, errors, j)) for j,(o,q) in enumerate(zip(outputs, out_queues))]
+
+	n = 0
+	i = 0
+	cur_time = time.time()
+	checkpoint_time = time.time()
+	try:
+		for batches in lockstep_batches(inputs, lines_per_record, threads, batch_size, skip_records):
+			num_records = len(batches[0])
+			keep = select(batches[0].barcodes())
+			if interleave:
+				out_queues[0].put("".join([r for records in zip(*[b.record_list(keep) for b in batches]) for r in records]))
+			else:
+				for b,q in zip(batches, out_queues):
+					q.put(b.records(keep))
+
+			cur_time = report_progress(n, i, num_records, len(keep), cur_time)
+			n = n + num_records
+			i = i + len(keep)
+
+			if checkpoint is not None and time.time() - checkpoint_time >= CHECKPOINT_SECONDS:
+				mark = CheckpointMark(len(outputs))
+				for q in out_queues:
+					q.put(mark)
+				mark.done.wait()
+				if not errors:
+					checkpoint(n, i, mark.sizes)
+				checkpoint_time = time.time()
+	finally:
+		for q in out_queues:
+			q.put(None)
+		for w in writers:
+			w.join()
+
+	if errors:
+		errors[0].reraise()
+	return (n, i)
+
+class OutputPool(object):
+	# at most max_open output files are open at once; the least recently written one is closed to make room
+	# and reopened in append mode when it is next written (BGZF outputs are closed without the EOF block,
+	# which is only added by close_all)
+
+	def __init__(self, opener, max_open=100):
+		self.opener = opener
+		self.max_open = max(1,int(max_open))
+		self.handles = OrderedDict()
+		self.started = set()
+
+	def get(self, key):
+		handle = self.handles.pop(key, None)
+		if handle is None:
+			if len(self.handles)>=self.max_open:
+				(old_key, old_handle) = self.handles.popitem(last=False)
+				suspend_output(old_handle)
+			handle = self.opener(key, key in self.started)
+			self.started.add(key)
+		self.handles[key] = handle
+		return handle
+
+	def write(self, routed_chunks):
+		for (key, data) in routed_chunks:
+			self.get(key).write(data)
+
+	def close_all(self, keys=()):
+		# every output is finished with a full close: suspended ones are reopened for it,
+		# and keys that were never written are created (empty)
+		for handle in self.handles.values():
+			handle.close()
+		for key in list(keys) + [k for k in self.started if k not in keys]:
+			if key not in self.handles:
+				self.opener(key, key in self.started).close()
+		self.handles = OrderedDict()
+		self.started = set()
+
+def suspend_output(handle):
+	if isinstance(handle, BgzfWriter):
+		handle.close(eof=False)
+	else:
+		handle.close()
+
+def run_demux(inputs, lines_per_record, out_pool, route, threads=1, batch_size=BATCH_SIZE):
+	# route(barcodes) returns {set: indices of the records for that set}; records of set s from input j
+	# are written to out_pool key (s, j) by a single writer thread
+	out_queue = Queue(QUEUE_SIZE)
+	errors = []
+	writer = start_thread(write_batches, (out_pool, out_queue, errors))
+
+	n = 0
+	i = 0
+	cur_time = time.time()
+	try:
+		for batches in lockstep_batches(inputs, lines_per_record, threads, batch_size):
+			num_records = len(batches[0])
+			routes = route(batches[0].barcodes())
+			out_queue.put([((s,j), b.records(keep)) for s,keep in routes.items() for j,b in enumerate(batches)])
+
+			num_kept = len(set([k for keep in routes.values() for k in keep]))
+			cur_time = report_progress(n, i, num_records, num_kept, cur_time)
+			n = n + num_records
+			i = i + num_kept
+	finally:
+		out_queue.put(None)
+		writer.join()
+
+	if errors:
+		errors[0].reraise()
+	return (n, i)
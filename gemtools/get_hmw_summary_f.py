@@ -1,8 +1,21 @@
+import os
 import sys
 import pandas as pd
+import numpy as np
+
+from gemtools.bc_counts import WINDOW_COLS, count_hits, is_long_table, write_long_hits
+
+## SUMMARY OF THE BARCODES (HMW MOLECULES) THAT SPAN BOTH BREAKPOINTS OF AN SV
+## the count_bcs table, wide or long (see bc_counts), is viewed as its (window, barcode) pairs with reads and summarized
+## per (barcode, SV, breakpoint) by a single groupby; a barcode with reads around both breakpoints of an SV gets one row
+## for that SV
+
+SUMMARY_COLS = ['id','name_1','name_2','start_1','start_2','end_1','end_2','num_windows_1','num_windows_2','num_reads_1','num_reads_2','len_1','len_2','mol_len','num_windows','num_reads','barcode']
 
 def get_hmw_summary(**kwargs):
-	
+
+	if 'infile' in kwargs:
+		bc_c = pd.read_table(kwargs['infile'], sep="\t")
 	if 'bc_counts' in kwargs:
 		bc_c = kwargs['bc_counts']
 	if 'out' in kwargs:
@@ -10,59 +23,44 @@ def get_hmw_summary(**kwargs):
 
 	df = bc_c
 
-	header = df.columns.tolist()
-	bc_header = [b for b in header if b not in ["id","name","chrom","window_start","window_end"]]
-
-	b_keep = []
-	info_keep = []
-
-	for b in bc_header:
-		print b
-		df_b = df[["id","name","chrom","window_start","window_end",b]]	
-		df_b = df_b.loc[df[b]>0]
-		if not df_b.empty:
-			output = df_b.groupby(["id","name"], sort=False).agg({"window_start":min, "window_end":max, b: ['count','sum']}).reset_index()
-			if len(output.index)<2:
-				print "empty"
-			else:
-				print output
-				output.columns = ['_'.join(col).strip() for col in output.columns.values]
-				output.columns = ['id','name','end','start','num_windows','num_reads']
-				output = output[['id','name','start','end','num_windows','num_reads']]
-				#output['len'] = output['end'] - output['start']
-				print output
-
-		
-				output = output.groupby('id', sort=False)['name','start','end','num_windows','num_reads'].apply(lambda x: pd.DataFrame(x.values)).unstack().reset_index()
-				print output
-				output.columns = ['id','name_1', 'name_2', 'start_1', 'start_2','end_1', 'end_2', 'num_windows_1', 'num_windows_2', 'num_reads_1', 'num_reads_2']
-				output['len_1'] = output.apply(lambda row: int(row['end_1']) - int(row['start_1']), axis=1)
-				output['len_2'] = output.apply(lambda row: int(row['end_2']) - int(row['start_2']), axis=1)
-				output['mol_len'] = output.apply(lambda row: int(row['len_1']) + int(row['len_2']), axis=1)
-				output['num_windows'] = output.apply(lambda row: int(row['num_windows_1']) + int(row['num_windows_2']), axis=1)
-				output['num_reads'] = output.apply(lambda row: int(row['num_reads_1']) + int(row['num_reads_2']), axis=1)
-				output['bc'] = b
-		
-				outlist = output.values.tolist()[0]
-		
-				print output
-				print outlist
-		
+	(hits, bc_header) = count_hits(df)
+	info_df = summarize_spanning_bcs(hits, bc_header)
+	info_df.to_csv(outpre, sep="\t", index=False)
 
-				b_keep.append(b)
-				info_keep.append(outlist)	
-		else:
-			print "empty"
+	# count table restricted to the spanning barcodes (input for plot_hmw), in the format of the input table
+	spanning = set(info_df['barcode'])
+	keep = [b in spanning for b in bc_header]
+	subset_file = os.path.splitext(str(outpre))[0] + ".bc_windows.subset.txt"
+	if is_long_table(df):
+		write_long_hits(hits, bc_header, keep, subset_file)
+	else:
+		b_keep = [b for b in bc_header if b in spanning]
+		keep_cols = [c for c in WINDOW_COLS if c in df.columns] + b_keep
+		df[keep_cols].to_csv(subset_file, sep="\t", index=False)
 
-	keep_cols = ["id","name","chrom","window_start","window_end"] + b_keep
-	final_df = df[keep_cols]
-	final_df.to_csv("test" + ".bc_windows.subset.txt", sep="\t", index=False)
+	print "%d of %d barcodes span both breakpoints of an SV" % (sum(keep), len(bc_header))
 
 
-	info_df = pd.DataFrame(info_keep, columns=['id','name_1', 'name_2', 'start_1', 'start_2','end_1', 'end_2', 'num_windows_1', 'num_windows_2', 'num_reads_1', 'num_reads_2', 'len_1', 'len_2', 'mol_len', 'num_windows', 'num_reads', 'barcode'])
+def summarize_spanning_bcs(hits, bc_header):
 
-	info_df.to_csv(outpre, sep="\t", index=False)
+	hits = hits.rename(columns={'count': 'reads'})
 
-	print len(final_df.columns)
+	# one row per (barcode, SV, breakpoint); breakpoints are numbered in table order
+	bp = hits.groupby(['bc','id','name'], sort=False).agg({'window_start': 'min', 'window_end': 'max', 'reads': ['count','sum']})
+	bp.columns = ['_'.join(col) for col in bp.columns.values]
+	bp = bp.reset_index().rename(columns={'window_start_min': 'start', 'window_end_max': 'end', 'reads_count': 'num_windows', 'reads_sum': 'num_reads'})
+	bp['bp'] = bp.groupby(['bc','id'], sort=False).cumcount()
+	bp = bp.loc[bp.groupby(['bc','id'], sort=False)['bp'].transform('size')==2]
 
+	cols_bp = ['bc','id','name','start','end','num_windows','num_reads']
+	info_df = pd.merge(bp.loc[bp['bp']==0, cols_bp], bp.loc[bp['bp']==1, cols_bp], on=['bc','id'], suffixes=('_1','_2'), sort=False)
+	info_df['len_1'] = info_df['end_1'] - info_df['start_1']
+	info_df['len_2'] = info_df['end_2'] - info_df['start_2']
+	info_df['mol_len'] = info_df['len_1'] + info_df['len_2']
+	info_df['num_windows'] = info_df['num_windows_1'] + info_df['num_windows_2']
+	info_df['num_reads'] = info_df['num_reads_1'] + info_df['num_reads_2']
+	info_df['barcode'] = np.array(bc_header, dtype=object)[info_df['bc'].values]
 
+	# barcodes in table column order
+	info_df = info_df.iloc[np.argsort(info_df['bc'].values, kind='mergesort')]
+	return info_df[SUMMARY_COLS]
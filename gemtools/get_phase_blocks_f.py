@@ -8,6 +8,9 @@ import pysam
 import numpy as np
 import vcf
 
+from gemtools.tabix_table import write_tabix_table
+from gemtools.block_index import build_block_index
+
 def barcodeSplit(bc_str):
 		bc_list = str(bc_str).split(";")
 		bc_list_pre = [value.partition('_')[0] for value in bc_list if '_' in value]
@@ -70,6 +73,13 @@ def get_phase_blocks(phased_basic_file='None',outpre='out',**kwargs):
 	df_out=pd.DataFrame(phase_data)
 	df_out.columns=["chr", "beg_pos", "end_pos", "dist", "PS", "all_SNVs", "phased_het", "total", "unique", "hap1_total", "hap1_unique", "hap2_total", "hap2_unique"]
 
-	df_out.to_csv(str(outpre), sep="\t", index=False)
+	# a .gz output is bgzip-compressed and tabix-indexed on 'chr', 'beg_pos' and 'end_pos' for region queries
+	if str(outpre).endswith(".gz"):
+		df_out.sort_values(by=['chr','beg_pos'], inplace=True)
+		write_tabix_table(df_out, outpre, seq_col=0, start_col=1, end_col=2)
+	else:
+		df_out.to_csv(str(outpre), sep="\t", index=False)
+		# interval index of the blocks, for region queries (see block_index)
+		build_block_index(str(outpre)).save(str(outpre))
 
 
@@ -8,6 +8,8 @@ import pysam
 import numpy as np
 import vcf
 
+from gemtools.tabix_table import write_tabix_table
+
 
 def parse_phase_blocks(r,s):
 	chr = r.CHROM
@@ -114,4 +116,8 @@ def get_phased_basic(inputvcf='None',outpre='out',c='None',**kwargs):
 	df.columns=['#chrom','pos_0','pos','ref','alt','filter','gt','allele_list','num_alts','block_id','phase_status','allele_1','allele_2','base_1','base_2','num_alleles','hom_status','var_type','bc1','bc1_ct','bc2','bc2_ct']
 	df.fillna("n/a", inplace=True)
 
-	df.to_csv(str(outpre), sep="\t", index=False)
+	# a .gz output is bgzip-compressed and tabix-indexed on '#chrom' and 'pos' for region queries
+	if str(outpre).endswith(".gz"):
+		write_tabix_table(df, outpre, seq_col=0, start_col=2, end_col=2)
+	else:
+		df.to_csv(str(outpre), sep="\t", index=False)
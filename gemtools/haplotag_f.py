@@ -0,0 +1,110 @@
+import os
+import sys
+import multiprocessing
+import numpy as np
+import pysam
+
+from gemtools.index_phased_bcs_f import build_phased_bc_index, load_phased_bc_index
+
+## the barcode index is a module global so that forked shard workers share the parent's (memory-mapped) copy
+BC_INDEX = None
+
+def chrom_bc_tags(bc_index, chrom):
+	"""For one chromosome, map each barcode to the (beg, end, PS, HP) of the blocks it is assigned to"""
+	blocks = bc_index.blocks
+	chrom_blocks = np.nonzero(blocks['chrom']==chrom)[0]
+	if len(chrom_blocks)==0:
+		return {}
+
+	records = bc_index.records
+	rec_bc = np.repeat(np.arange(len(bc_index.bcs)), np.diff(bc_index.offsets))
+	keep = np.in1d(records['block'], chrom_blocks) & (records['hap1']!=records['hap2'])
+
+	blk = records['block'][keep]
+	hp = np.where(records['hap1'][keep]>records['hap2'][keep], 1, 2)
+
+	bc_tags = {}
+	bcs = bc_index.bcs
+	for i,beg,end,ps,h in zip(rec_bc[keep].tolist(), blocks['beg'][blk].tolist(), blocks['end'][blk].tolist(), blocks['ps'][blk].tolist(), hp.tolist()):
+		bc_tags.setdefault(bcs[i], []).append((beg, end, ps, h))
+	return bc_tags
+
+def tag_shard(shard_args):
+	(bam_input, region, shard_out, nthreads) = shard_args
+
+	bam_open = pysam.AlignmentFile(bam_input, 'rb')
+	out_bam = pysam.AlignmentFile(shard_out, 'wb', template=bam_open, threads=nthreads)
+
+	if region=="*":
+		bc_tags = {}
+	else:
+		bc_tags = chrom_bc_tags(BC_INDEX, region)
+
+	n = 0
+	i = 0
+	for r in bam_open.fetch(region=region):
+		n = n + 1
+		if r.has_tag("BX"):
+			hits = bc_tags.get(r.get_tag("BX"))
+			if hits:
+				pos = r.reference_start + 1
+				for (beg,end,ps,hp) in hits:
+					if beg <= pos <= end:
+						r.set_tag("HP", hp, value_type='i')
+						r.set_tag("PS", ps, value_type='i')
+						i = i + 1
+						break
+		out_bam.write(r)
+
+	out_bam.close()
+	bam_open.close()
+	return (region, n, i)
+
+def haplotag(outpre='out.bam',nthreads=3,nprocs=1,**kwargs):
+
+	if 'bam' in kwargs:
+		bam_input = kwargs['bam']
+	if 'bc_index' in kwargs:
+		index_prefix = kwargs['bc_index']
+	if 'vcf' in kwargs:
+		vcf_input = kwargs['vcf']
+	if 'out' in kwargs:
+		outpre = kwargs['out']
+	if 'nthreads' in kwargs:
+		nthreads = kwargs['nthreads']
+	if 'nprocs' in kwargs:
+		nprocs = kwargs['nprocs']
+
+	global BC_INDEX
+	if str(index_prefix)!="None":
+		BC_INDEX = load_phased_bc_index(index_prefix)
+	else:
+		BC_INDEX = build_phased_bc_index(vcf_input)
+
+	bam_open = pysam.AlignmentFile(bam_input, 'rb')
+	if not bam_open.has_index():
+		print str(bam_input) + " must be indexed (samtools index) -- exiting"
+		sys.exit(1)
+	regions = list(bam_open.references) + ["*"]
+	bam_open.close()
+
+	# one shard per chromosome (plus the unplaced unmapped reads); shards are concatenated in reference order
+	shard_list = [(bam_input, reg, str(outpre) + ".shard_" + str(k) + ".bam", nthreads) for k,reg in enumerate(regions)]
+
+	if int(nprocs)>1:
+		pool = multiprocessing.Pool(int(nprocs))
+		shard_results = pool.map(tag_shard, shard_list, chunksize=1)
+		pool.close()
+		pool.join()
+	else:
+		shard_results = [tag_shard(s) for s in shard_list]
+
+	shard_files = [s[2] for s in shard_list]
+	pysam.cat("-o", str(outpre), *shard_files)
+	for s in shard_files:
+		os.remove(s)
+	pysam.index(str(outpre))
+
+	n = sum([x[1] for x in shard_results])
+	i = sum([x[2] for x in shard_results])
+	print "%d reads written, %d reads tagged with a haplotype" % (n, i)
@@ -0,0 +1,186 @@
+import sys
+import os
+from array import array
+import pandas as pd
+import numpy as np
+import vcf
+
+## ON-DISK LAYOUT OF THE INDEX (all files share the output prefix)
+##   <prefix>.bcs.txt      one barcode per line; line number is the integer barcode id
+##   <prefix>.blocks.npy   one row per phase block: chrom, PS, first and last variant position
+##   <prefix>.offsets.npy  records of barcode i are records[offsets[i]:offsets[i+1]]
+##   <prefix>.records.npy  one row per (barcode, phase block): block row, hap1 and hap2 SNV support
+
+BLOCK_DTYPE = np.dtype([('chrom','S64'),('ps','i8'),('beg','i8'),('end','i8')])
+RECORD_DTYPE = np.dtype([('block','i4'),('hap1','i4'),('hap2','i4')])
+
+INDEX_SUFFIXES = ['.bcs.txt','.blocks.npy','.offsets.npy','.records.npy']
+
+def barcodeSplit(bc_str):
+		bc_list = str(bc_str).split(";")
+		bc_list_pre = [value.partition('_')[0] for value in bc_list if '_' in value]
+		if "n/a" in bc_list_pre:
+			nona_list = [value for value in bc_list_pre if value!="n/a"]
+			return nona_list
+		else:
+			return bc_list_pre
+
+
+class PhasedBcIndex(object):
+	"""Barcode -> (phase block, haplotype) lookup table built from a Long Ranger vcf"""
+
+	def __init__(self, bcs, blocks, offsets, records):
+		self.bcs = bcs
+		self.bc_ids = dict((b,i) for i,b in enumerate(bcs))
+		self.blocks = blocks
+		self.offsets = offsets
+		self.records = records
+
+	def lookup(self, bc):
+		"""Return the records (block, hap1, hap2) of a single barcode -- empty if not phased"""
+		i = self.bc_ids.get(bc)
+		if i is None:
+			return self.records[0:0]
+		return self.records[self.offsets[i]:self.offsets[i+1]]
+
+	def assign(self, bcs):
+		"""Join a list of barcodes against the index; one output row per (barcode, phase block)"""
+		bcs = list(bcs)
+		ids = np.array([self.bc_ids.get(b,-1) for b in bcs], dtype=np.int64)
+		found = np.nonzero(ids>=0)[0]
+
+		starts = np.asarray(self.offsets[ids[found]], dtype=np.int64)
+		lens = np.asarray(self.offsets[ids[found]+1], dtype=np.int64) - starts
+		total = int(lens.sum())
+
+		# expand each barcode to the range of its records without a python loop
+		first = np.repeat(np.cumsum(lens)-lens, lens)
+		rec_idx = np.repeat(starts, lens) + (np.arange(total) - first)
+		recs = self.records[rec_idx]
+		blks = self.blocks[recs['block']]
+
+		df = pd.DataFrame({'bc':np.array(bcs, dtype=object)[np.repeat(found, lens)],
+			'chrom':blks['chrom'], 'PS':blks['ps'], 'beg_pos':blks['beg'], 'end_pos':blks['end'],
+			'hap1_support':recs['hap1'], 'hap2_support':recs['hap2']})
+		df['hap'] = np.where(df['hap1_support']>df['hap2_support'], 1, np.where(df['hap2_support']>df['hap1_support'], 2, 0))
+		return df[['bc','chrom','PS','beg_pos','end_pos','hap1_support','hap2_support','hap']]
+
+	def save(self, prefix):
+		with open(prefix + ".bcs.txt", 'w') as f:
+			for b in self.bcs:
+				f.write(str(b) + "\n")
+		np.save(prefix + ".blocks.npy", np.asarray(self.blocks))
+		np.save(prefix + ".offsets.npy", np.asarray(self.offsets))
+		np.save(prefix + ".records.npy", np.asarray(self.records))
+
+
+def load_phased_bc_index(prefix):
+	"""Open an index written by 'index_phased_bcs'; the arrays are memory-mapped, not read"""
+	for s in INDEX_SUFFIXES:
+		if not os.path.isfile(prefix + s):
+			raise IOError(str(prefix + s) + " does not exist -- run 'gemtools -T index_phased_bcs' first")
+	with open(prefix + ".bcs.txt") as f:
+		bcs = f.read().splitlines()
+	blocks = np.load(prefix + ".blocks.npy", mmap_mode='r')
+	offsets = np.load(prefix + ".offsets.npy", mmap_mode='r')
+	records = np.load(prefix + ".records.npy", mmap_mode='r')
+	return PhasedBcIndex(bcs, blocks, offsets, records)
+
+
+def build_phased_bc_index(inputvcf, c='None'):
+
+	vcf_reader = vcf.Reader(filename=inputvcf)
+	cur_sample = vcf_reader.samples[0]
+
+	if c=='None':
+		vcf_iter = vcf_reader
+	else:
+		vcf_iter = vcf_reader.fetch(str(c))
+
+	bc_ids = {}
+	block_ids = {}
+	block_info = []
+
+	# one entry per (barcode, block, haplotype) observation on a phased het SNV
+	obs_bc = array('i')
+	obs_block = array('i')
+	obs_hap = array('b')
+
+	for r in vcf_iter:
+		format_field = (r.FORMAT).split(":")
+		if 'PS' not in format_field:
+			continue
+		call = r.genotype(cur_sample)
+		ps = call['PS']
+		if ps is None:
+			continue
+
+		# phase block span covers every variant carrying the PS -- same as 'get_phase_blocks'
+		key = (r.CHROM, int(ps))
+		b = block_ids.get(key)
+		if b is None:
+			b = block_ids[key] = len(block_info)
+			block_info.append([r.CHROM, int(ps), r.POS, r.POS])
+		else:
+			block_info[b][2] = min(block_info[b][2], r.POS)
+			block_info[b][3] = max(block_info[b][3], r.POS)
+
+		# only phased het SNVs that pass filter contribute barcode support
+		geno = call['GT']
+		if not (r.is_snp and r.FILTER==[] and 'BX' in format_field and '|' in str(geno)):
+			continue
+		alleles = geno.split("|")
+		if alleles[0]==alleles[1] or not (alleles[0].isdigit() and alleles[1].isdigit()):
+			continue
+
+		bx = call['BX']
+		for hap,a in [(1,int(alleles[0])),(2,int(alleles[1]))]:
+			for bc in barcodeSplit(bx[a]):
+				i = bc_ids.get(bc)
+				if i is None:
+					i = bc_ids[bc] = len(bc_ids)
+				obs_bc.append(i)
+				obs_block.append(b)
+				obs_hap.append(hap)
+
+	blocks = np.array([tuple(x) for x in block_info], dtype=BLOCK_DTYPE)
+
+	# renumber barcodes so that ids follow sorted barcode order
+	bcs_first_seen = sorted(bc_ids, key=bc_ids.get)
+	order = np.argsort(np.array(bcs_first_seen, dtype=object), kind='mergesort')
+	rank = np.empty(len(order), dtype=np.int64)
+	rank[order] = np.arange(len(order))
+	bcs = [bcs_first_seen[i] for i in order]
+
+	obs_bc = rank[np.array(obs_bc, dtype=np.int64)]
+	obs_block = np.array(obs_block, dtype=np.int64)
+	obs_hap = np.array(obs_hap, dtype=np.int8)
+
+	# collapse observations to one record per (barcode, block) with support counts per haplotype
+	keys = obs_bc*max(len(blocks),1) + obs_block
+	uq_keys, inv = np.unique(keys, return_inverse=True)
+	records = np.zeros(len(uq_keys), dtype=RECORD_DTYPE)
+	records['block'] = uq_keys % max(len(blocks),1)
+	records['hap1'] = np.bincount(inv, weights=(obs_hap==1), minlength=len(uq_keys))
+	records['hap2'] = np.bincount(inv, weights=(obs_hap==2), minlength=len(uq_keys))
+
+	rec_bc = uq_keys // max(len(blocks),1)
+	offsets = np.searchsorted(rec_bc, np.arange(len(bcs)+1)).astype(np.int64)
+
+	return PhasedBcIndex(bcs, blocks, offsets, records)
+
+
+def index_phased_bcs(inputvcf='None',outpre='out',c='None',**kwargs):
+
+	if 'vcf' in kwargs:
+		inputvcf = kwargs['vcf']
+	if 'out' in kwargs:
+		outpre = kwargs['out']
+	if 'chrom' in kwargs:
+		c = kwargs['chrom']
+
+	bc_index = build_phased_bc_index(inputvcf, c)
+	bc_index.save(str(outpre))
+
+	print "Indexed %d barcodes across %d phase blocks" % (len(bc_index.bcs), len(bc_index.blocks))
+	return bc_index
@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import hashlib
+import mappy as mp
+
+from gemtools.checkpoint import input_signature, write_checkpoint, read_checkpoint
+
+## PERSISTENT MINIMAP2 INDEXES
+## an index is built once per (reference, preset) and cached as <cache dir>/<reference file name>.<path hash>.<preset>.mmi
+## next to it, <...>.mmi.json records what the index was built from (reference path, size and mtime; preset; mappy
+## version) and the size, mtime and md5 of the .mmi; the cached index is used when its record matches the reference and
+## preset, and the .mmi is the one that was written -- the md5 is only recomputed when the size or mtime of the .mmi
+## differ from the record (a copied or touched cache), and the record is updated when it still matches
+## the record also lists the reference sequences and their lengths (for output headers), so they are not read back
+## out of the index
+## a reference that is itself a .mmi file is loaded as it is
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".gemtools", "mmi")
+
+def index_path(genome, preset, index_dir):
+	path_hash = hashlib.md5(os.path.abspath(genome)).hexdigest()[:8]
+	return os.path.join(index_dir, "%s.%s.%s.mmi" % (os.path.basename(genome), path_hash, preset or "default"))
+
+def file_md5(path):
+	h = hashlib.md5()
+	with open(path, 'rb') as f:
+		for chunk in iter(lambda: f.read(1<<22), b''):
+			h.update(chunk)
+	return h.hexdigest()
+
+def mmi_record(mmi):
+	st = os.stat(mmi)
+	return {'size': st.st_size, 'mtime': st.st_mtime}
+
+def index_is_valid(genome, preset, mmi):
+	if not (os.path.isfile(mmi) and os.path.isfile(mmi + ".json")):
+		return False
+	try:
+		record = read_checkpoint(mmi + ".json")
+	except ValueError:
+		return False
+	if record.get('reference')!=input_signature(genome) or record.get('preset')!=preset or record.get('mappy')!=mp.__version__:
+		return False
+
+	if record.get('mmi')!=mmi_record(mmi):
+		if file_md5(mmi)!=record.get('md5'):
+			return False
+		record['mmi'] = mmi_record(mmi)
+		write_checkpoint(mmi + ".json", record)
+	return True
+
+def build_index(genome, preset, nthreads, mmi):
+	# the index is written to a temporary file and moved into place once complete, then its record is written
+	index_dir = os.path.dirname(mmi)
+	if index_dir and not os.path.isdir(index_dir):
+		os.makedirs(index_dir)
+	tmp_file = mmi + ".tmp"
+	a = mp.Aligner(str(genome), preset=preset, n_threads=nthreads, fn_idx_out=tmp_file)
+	if not a or not os.path.isfile(tmp_file):
+		raise Exception("ERROR: failed to build index")
+	os.rename(tmp_file, mmi)
+	lengths = [[name, len(a.seq(name))] for name in a.seq_names]
+	record = {'reference': input_signature(genome), 'preset': preset, 'mappy': mp.__version__, 'md5': file_md5(mmi), 'mmi': mmi_record(mmi), 'lengths': lengths}
+	write_checkpoint(mmi + ".json", record)
+	return a
+
+def load_aligner(genome, preset=None, nthreads=3, index_dir=None):
+	"""mappy Aligner of genome with preset, from the cached index if there is a valid one (built and cached otherwise)"""
+	if str(genome).endswith(".mmi"):
+		a = mp.Aligner(str(genome), preset=preset, n_threads=nthreads)
+	else:
+		mmi = index_path(genome, preset, index_dir or DEFAULT_INDEX_DIR)
+		if index_is_valid(genome, preset, mmi):
+			a = mp.Aligner(mmi, preset=preset, n_threads=nthreads)
+		else:
+			print >>sys.stderr, "Building minimap2 index " + mmi
+			try:
+				a = build_index(genome, preset, nthreads, mmi)
+			except (IOError, OSError) as e:
+				print >>sys.stderr, "Cannot write " + mmi + " (" + str(e) + ") -- the index is not cached"
+				a = mp.Aligner(str(genome), preset=preset, n_threads=nthreads)
+	if not a: raise Exception("ERROR: failed to load/build index")
+	return a
+
+def reference_lengths(aligner, genome, preset=None, index_dir=None):
+	"""[(name, length)] of the reference sequences: from the reference's .fai, or the record of its index (genome
+	itself when it is a .mmi, otherwise the cached index); read out of the index only when neither has them"""
+	if os.path.isfile(str(genome) + ".fai"):
+		with open(str(genome) + ".fai") as f:
+			return [(l.split("\t")[0], int(l.split("\t")[1])) for l in f if l.strip()]
+	mmi = str(genome) if str(genome).endswith(".mmi") else index_path(genome, preset, index_dir or DEFAULT_INDEX_DIR)
+	try:
+		record = read_checkpoint(mmi + ".json")
+	except (IOError, ValueError):
+		record = {}
+	if record.get('lengths') and [n for (n,l) in record['lengths']]==list(aligner.seq_names):
+		return [(str(n), int(l)) for (n,l) in record['lengths']]
+	return [(name, len(aligner.seq(name))) for name in aligner.seq_names]
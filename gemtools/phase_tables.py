@@ -0,0 +1,119 @@
+import pandas as pd
+import numpy as np
+
+from gemtools.tabix_table import is_tabix_table, fetch_region_table
+from gemtools.block_index import block_index_from_table, open_block_index
+
+## PHASED_BASIC / PHASE_BLOCKS TABLES FOR REGION PLOTS
+## tables that are not tabix-indexed are read (and typed) once per process and cached -- variants split by chromosome
+## and sorted by position, blocks with their interval index (see block_index) -- so the rows of a region are found by
+## binary search; a batch of region plots parses the tables once -- load_tables is called before the worker processes
+## are forked, and they share the cache
+## tabix-indexed tables are read per region; a single region of a plain blocks file is read through the saved index
+
+TABLE_CACHE = {}
+
+class ChromTable(object):
+	# rows of a table grouped by chromosome and sorted by position; the rows of a region are returned in table order
+
+	def __init__(self, df, chrom_col, pos_col):
+		order = np.argsort(df[pos_col].values, kind='mergesort')
+		df = df.iloc[order]
+		self.empty = df.iloc[0:0]
+		self.parts = {}
+		for (chrom, rows) in df.groupby(chrom_col, sort=False).indices.items():
+			self.parts[chrom] = (df.iloc[rows], df[pos_col].values[rows], order[rows])
+
+	def rows(self, chrom, i, j):
+		(part, pos, order) = self.parts[chrom]
+		return part.iloc[i + np.argsort(order[i:j], kind='mergesort')]
+
+	def rows_between(self, chrom, lo, hi):
+		# rows with lo < position < hi
+		if chrom not in self.parts:
+			return self.empty
+		pos = self.parts[chrom][1]
+		return self.rows(chrom, np.searchsorted(pos, lo, side='right'), np.searchsorted(pos, hi, side='left'))
+
+def typed_basic(df):
+	df[['#chrom']] = df[['#chrom']].astype(str)
+	df[['pos']] = df[['pos']].astype(int)
+	return ChromTable(df, '#chrom', 'pos')
+
+def typed_blocks(df):
+	df[['chr']] = df[['chr']].astype(str)
+	df[['beg_pos','end_pos']] = df[['beg_pos','end_pos']].astype(int)
+	return df
+
+def indexed_blocks(df):
+	df = typed_blocks(df)
+	return (df, block_index_from_table(df))
+
+def read_table(infile, set_types, chrom=None, start=None, stop=None):
+	if chrom is not None and is_tabix_table(infile):
+		return set_types(fetch_region_table(infile, chrom, start, stop))
+	if infile not in TABLE_CACHE:
+		TABLE_CACHE[infile] = set_types(pd.read_table(infile, sep="\t"))
+	return TABLE_CACHE[infile]
+
+def load_tables(infile_basic, infile_blocks):
+	# for batches: whole tables are loaded here, once, before the plots are rendered
+	for (infile, set_types) in [(infile_basic, typed_basic), (infile_blocks, indexed_blocks)]:
+		if not is_tabix_table(infile):
+			read_table(infile, set_types)
+
+def parse_region(region):
+	(chrom, start, stop) = (str(region.split(",")[0]), int(region.split(",")[1]), int(region.split(",")[2]))
+	# inverted regions are rejected here, so tabix-indexed, plain and cached tables all get the same overlap query
+	if start > stop:
+		raise ValueError("region " + str(region) + ": start is after end")
+	return (chrom, start, stop)
+
+def read_bed_regions(bed, outpre):
+	# (region as for -f, output png) for every region of a bed file: <outpre>.<name>.png, where the name is the 4th
+	# column, or chrom_start_end
+	outpre = outpre[:-len(".png")] if outpre.endswith(".png") else outpre
+	regions = []
+	with open(bed,'r') as f:
+		for line in f:
+			fields = line.rstrip("\r\n").split("\t")
+			if not fields[0] or fields[0].startswith("#") or fields[0].startswith("track") or fields[0].startswith("browser"):
+				continue
+			if len(fields)<3:
+				raise ValueError(str(bed) + ": expected at least 3 tab-separated columns (chrom, start, end), got: " + "\t".join(fields))
+			name = fields[3] if len(fields)>3 and fields[3] else "_".join(fields[0:3])
+			region = ",".join(fields[0:3])
+			try:
+				parse_region(region)
+			except ValueError as e:
+				raise ValueError(str(bed) + ": " + str(e))
+			regions.append((region, outpre + "." + name + ".png"))
+	return regions
+
+def region_axis_name(chr):
+	if chr.startswith("chr"):
+		return chr + " coordinate (Mb)"
+	return "chr" + chr + " coordinate (Mb)"
+
+def region_vars(infile_basic, chr, start, stop):
+	# SNVs in region (that pass filter)
+	df_basic = read_table(infile_basic, typed_basic, chr, start, stop).rows_between(chr, start, stop)
+	df_basic = df_basic[(df_basic['var_type']=="snv") & (df_basic['filter']=="[]")].copy()
+	df_basic.rename(index=str, columns={"#chrom": "chrom"}, inplace=True)
+	return df_basic
+
+def region_blocks(infile_blocks, chr, start, stop):
+	# phase blocks in region (sharing at least one position with it), with their coordinates clipped to the region
+	if is_tabix_table(infile_blocks):
+		# (tabix intervals are half-open: from start-1, so that blocks ending at start are fetched too)
+		(df_blocks, block_index) = indexed_blocks(fetch_region_table(infile_blocks, chr, max(0,start-1), stop))
+		df_blocks = df_blocks.iloc[block_index.rows(chr, start, stop)]
+	elif infile_blocks in TABLE_CACHE:
+		(df_blocks, block_index) = TABLE_CACHE[infile_blocks]
+		df_blocks = df_blocks.iloc[block_index.rows(chr, start, stop)]
+	else:
+		df_blocks = typed_blocks(open_block_index(infile_blocks).fetch(infile_blocks, chr, start, stop))
+	df_blocks = df_blocks.loc[df_blocks['phased_het']>0].copy()
+	df_blocks['beg_pos_check'] = df_blocks['beg_pos'].apply(lambda x: max(x,start))
+	df_blocks['end_pos_check'] = df_blocks['end_pos'].apply(lambda x: min(x,stop))
+	return df_blocks
@@ -0,0 +1,19 @@
+## CHOICE OF PLOT RENDERING BACKEND
+##   R           ggplot2 through rpy2 (needs R, ggplot2 and gridExtra)
+##   matplotlib  matplotlib Agg, no R needed
+## rpy2 is only imported when the R backend is used, so gemtools runs without an R install
+
+BACKENDS = ('auto','R','matplotlib')
+
+def r_available():
+	try:
+		import rpy2.robjects
+	except Exception:
+		return False
+	return True
+
+def resolve_backend(backend='auto'):
+	"""'auto' is R when rpy2 (and R) can be loaded, matplotlib otherwise"""
+	if str(backend)=="auto" or str(backend)=="None":
+		return 'R' if r_available() else 'matplotlib'
+	return str(backend)
@@ -0,0 +1,45 @@
+import csv
+import multiprocessing
+
+## BATCH RENDERING: one plot per manifest row, rendered by a pool of worker processes
+## inputs shared by all plots are loaded by the caller before the pool is started (as module globals, which the
+## forked workers share); init_worker runs once in each worker to load the plotting backend (start R and compile
+## the plot functions, or import matplotlib), so every plot after a worker's first one renders with a warm backend
+
+def read_plot_manifest(manifest, num_cols):
+	rows = []
+	with open(manifest,'r') as f:
+		for line in csv.reader(f,delimiter='\t'):
+			if not line or not line[0] or line[0].startswith("#"):
+				continue
+			if len(line)<num_cols:
+				raise ValueError(str(manifest) + ": expected " + str(num_cols) + " tab-separated columns, got: " + "\t".join(line))
+			rows.append(line[:num_cols])
+	return rows
+
+def render_job(job):
+	# render(*args) returns None, or a message when there was nothing to plot; a failed plot does not stop the batch
+	(render, args) = job
+	try:
+		return render(*args)
+	except Exception as e:
+		return "failed: " + str(e)
+
+def render_plots(render, jobs, nprocs=1, init_worker=None, init_args=()):
+	"""Render render(*args) for every args in jobs (the last of the args is the output file); returns the number of plots rendered"""
+	if int(nprocs)>1 and len(jobs)>1:
+		pool = multiprocessing.Pool(min(int(nprocs), len(jobs)), init_worker, init_args)
+		results = pool.map(render_job, [(render, args) for args in jobs], chunksize=1)
+		pool.close()
+		pool.join()
+	else:
+		if init_worker is not None:
+			init_worker(*init_args)
+		results = [render_job((render, args)) for args in jobs]
+
+	for args,msg in zip(jobs, results):
+		if msg is not None:
+			print str(args[-1]) + "\t" + str(msg)
+	num_rendered = len([msg for msg in results if msg is None])
+	print "%d of %d plots rendered" % (num_rendered, len(jobs))
+	return num_rendered
@@ -4,11 +4,15 @@ import __main__ as main
 import pandas as pd
 import numpy as np
 import math
-import rpy2.robjects as robj
-import rpy2.robjects.pandas2ri # for dataframe conversion
-from rpy2.robjects.packages import importr
 
-def plot_hmw(outpre='out',**kwargs):
+from gemtools.plot_backend import resolve_backend
+from gemtools.plot_batch import read_plot_manifest, render_plots
+from gemtools.bc_counts import count_hits
+
+## the compiled R plot functions (see r_plot_funcs)
+R_PLOT_FUNCS = None
+
+def plot_hmw(outpre='out',backend='auto',manifest='None',nprocs=1,raster=False,max_bcs=None,**kwargs):
 
 	if 'in_windows' in kwargs:
 		infile= kwargs['in_windows']
@@ -16,108 +20,114 @@ def plot_hmw(outpre='out',**kwargs):
 		outpre = kwargs['out']
 	if 'sort_by_coord' in kwargs:
 		sort_by_pos = kwargs['sort_by_coord']
+	if 'backend' in kwargs:
+		backend = kwargs['backend']
+	if 'manifest' in kwargs:
+		manifest = kwargs['manifest']
+	if 'nprocs' in kwargs:
+		nprocs = kwargs['nprocs']
+	if 'raster' in kwargs:
+		raster = kwargs['raster']
+	if 'max_bcs' in kwargs:
+		max_bcs = kwargs['max_bcs']
+
+	if raster:
+		# rasterized plots are drawn by matplotlib
+		backend = 'matplotlib'
+
+	if str(manifest)!="None":
+		# batch mode: one (count table, output png) per manifest row
+		backend = resolve_backend(backend)
+		jobs = [(row[0], sort_by_pos, backend, raster, max_bcs, row[1]) for row in read_plot_manifest(manifest, 2)]
+		render_plots(render_hmw_file, jobs, nprocs, load_backend, (backend,))
+	else:
+		msg = render_hmw_file(infile, sort_by_pos, backend, raster, max_bcs, outpre)
+		if msg is not None:
+			print msg + " -- exiting"
+			sys.exit()
+
+
+def render_hmw_file(infile, sort_by_pos, backend, raster, max_bcs, outpre):
+	# returns None once the plot is written, or the reason there is nothing to plot
 
 	df=pd.read_table(infile,sep="\t")
 
-	# remove any barcodes with no read mappings in the region
-	bc_list_raw = df.columns.tolist()[5:]
-	df_map = df.loc[(df[bc_list_raw].sum(axis=1) != 0), ]
+	(m1, chr_list) = melt_hmw(*count_hits(df), sort_by_pos=sort_by_pos)
 
-	bc_list = df_map.columns.tolist()[5:]
-	if len(bc_list)==0:
-		print "No reads with these barcodes mapped in this region -- exiting"
-		sys.exit()
-	
+	if len(chr_list)==0:
+		return "No reads with these barcodes mapped in this region"
 	# count the number of chromosomes in the file -- can only plot 1 or 2
-	chr_list = list(set(df_map['chrom'].tolist()))
-
 	if len(chr_list)>2:
-		print "Cannot plot breakpoints on more than 2 chromosomes at this time -- exiting"
-		sys.exit()
-	elif len(chr_list)==1:
-		chr_val = str(chr_list[0])
-	# if the user wants sorted barcodes, perform the sorting
-	elif len(chr_list)==2:
-		chr_val1 = str(chr_list[0])
-		chr_val2 = str(chr_list[1])
+		return "Cannot plot breakpoints on more than 2 chromosomes at this time"
+
+	if max_bcs is not None:
+		m1 = subsample_bcs(m1, max_bcs)
+
+	if resolve_backend(backend)=='R':
+		render_hmw_r(m1, chr_list, outpre)
 	else:
-		print "This should not be possible -- what's going on with the chromosome list?"
-		sys.exit()
-		
-	print sort_by_pos
-	if sort_by_pos==False:
-		bc_order = bc_list
-
-	else: # if user wants sorting
-		if len(chr_list)==1:
-
-			min_list = []
-			for bc in bc_list:
-				df_tmp = df[['window_start',bc]]
-				df_tmp = df_tmp.loc[df_tmp[bc]>0]
-				if not df_tmp.empty:
-					min_val = df_tmp['window_start'].min()
-					max_val = df_tmp['window_start'].max()
-					min_list.append([bc,min_val,max_val])
-
-			min_df = pd.DataFrame(min_list, columns=['bc','min_val','max_val'])
-			min_df.sort_values(by='min_val', inplace=True)
-			bc_order = min_df['bc'].tolist()
-		
-		elif len(chr_list)==2:
-
-			df1 = df.loc[df['chrom']==chr_val1]
-			df2 = df.loc[df['chrom']==chr_val2]
-
-			min_list1=[]
-			min_list2=[]        
-			for bc in bc_list:
-				df_tmp = df1[['window_start',bc]]
-				df_tmp = df_tmp.loc[df_tmp[bc]>0]
-				if not df_tmp.empty:
-					min_val = df_tmp['window_start'].min()
-					max_val = df_tmp['window_start'].max()
-					min_list1.append([bc,min_val,max_val])
-				else:
-					df_tmp = df2[['window_start',bc]]
-					df_tmp = df_tmp.loc[df_tmp[bc]>0]
-					if not df_tmp.empty:
-						min_val = df_tmp['window_start'].min()
-						max_val = df_tmp['window_start'].max()
-						min_list2.append([bc,min_val,max_val])
-
-			min_df1 = pd.DataFrame(min_list1, columns=['bc','min_val','max_val'])
-			min_df2 = pd.DataFrame(min_list2, columns=['bc','min_val','max_val'])
-
-			if not min_df1.empty:
-				min_df1.sort_values(by='min_val', inplace=True)
-			if not min_df2.empty:
-				min_df2.sort_values(by='min_val', inplace=True)
-		
-			min_df = pd.concat([min_df1,min_df2])
-			bc_order = min_df['bc'].tolist()
-
-	# melt the data frame in prep for plotting
-
-	bc_counter=1
-	melt_list = []
-	for bo in bc_order:
-		df_bc = df[['chrom','window_start','window_end',bo]]
-		df_bc = df_bc.loc[df_bc[bo]>0]
-		if not df_bc.empty:
-			df_bc['value']=bc_counter
-			df_bc['variable']=bo
-			df_bc=df_bc[['chrom','window_start','window_end','value','variable']]
-			df_bc['bcs_split']= df_bc['variable'].apply(lambda x: x.split("-")[0])
-			bc_counter=bc_counter+1
-			melt_list.append(df_bc)
-
-	m1 = pd.concat(melt_list)
-
-	if m1.empty:
-		print "No mappings to plot -- exiting -- start by checking that you are used the correct bam file to generate the input file"
-		sys.exit()
-	
+		render_hmw_matplotlib(m1, chr_list, outpre, raster)
+
+
+def melt_hmw(hits, barcodes, sort_by_pos=False):
+	"""Long format of the hits of a barcode count table (see count_hits), with the barcode's plot row in 'value'"""
+	(rows, cols) = (hits['row'].values, hits['bc'].values)
+
+	# the chromosomes of the (window, barcode) pairs with reads
+	chr_list = list(set(hits['chrom'].values.tolist()))
+	if len(rows)==0 or len(chr_list)>2:
+		return (None, chr_list)
+
+	# barcodes are ordered by column, or with sorting, by their first chromosome (in chr_list order) and first position on it
+	if sort_by_pos:
+		chrom_idx = hits['chrom'].map(dict([(c,i) for i,c in enumerate(chr_list)])).values
+		starts = hits['window_start'].values
+		order = np.lexsort((starts, chrom_idx, cols))
+		first = order[np.r_[True, cols[order][1:]!=cols[order][:-1]]] # first hit of each barcode
+		bc_order = cols[first][np.lexsort((cols[first], starts[first], chrom_idx[first]))]
+	else:
+		bc_order = np.unique(cols)
+
+	# plot row of each barcode with reads: 1, 2, ... in bc_order
+	bc_row = np.zeros(len(barcodes), dtype=int)
+	bc_row[bc_order] = np.arange(1, len(bc_order)+1)
+
+	bc_names = np.array(barcodes, dtype=object)
+	order = np.lexsort((rows, bc_row[cols]))
+	(hits, cols) = (hits.iloc[order], cols[order])
+	m1 = pd.DataFrame({'chrom': hits['chrom'].values, 'window_start': hits['window_start'].values, 'window_end': hits['window_end'].values, 'value': bc_row[cols], 'variable': bc_names[cols], 'bcs_split': np.array([str(bc).split("-")[0] for bc in barcodes], dtype=object)[cols]}, columns=['chrom','window_start','window_end','value','variable','bcs_split'])
+	return (m1, chr_list)
+
+def subsample_bcs(m1, max_bcs):
+	# keeps at most max_bcs barcodes (plot rows), evenly spread over the plot rows so that a sorted plot keeps its shape,
+	# and renumbers them 1, 2, ...
+	num_rows = m1['value'].max()
+	if num_rows<=int(max_bcs):
+		return m1
+	keep = np.unique(np.round(np.linspace(1, num_rows, int(max_bcs))).astype(int))
+	new_row = np.zeros(num_rows+1, dtype=int)
+	new_row[keep] = np.arange(1, len(keep)+1)
+	m1 = m1.loc[new_row[m1['value'].values]>0].copy()
+	m1['value'] = new_row[m1['value'].values]
+	return m1
+
+def load_backend(backend):
+	# run once in each batch worker, so that R and the ggplot2 plot functions (or matplotlib) are loaded before the first plot
+	if backend=='R':
+		r_plot_funcs()
+	else:
+		import matplotlib.backends.backend_agg
+
+def r_plot_funcs():
+	# R is started and the plot functions compiled once per process, and reused by every plot of a batch
+	global R_PLOT_FUNCS
+	if R_PLOT_FUNCS is not None:
+		return R_PLOT_FUNCS
+
+	import rpy2.robjects as robj
+	import rpy2.robjects.pandas2ri # for dataframe conversion
+	robj.pandas2ri.activate()
+
 	plotFunc_1plot = robj.r("""
 		suppressMessages(library(ggplot2)) 
 		function(df,label_x,outpre)	{
@@ -226,11 +236,19 @@ def plot_hmw(outpre='out',**kwargs):
 		}
 	""")
 
+	R_PLOT_FUNCS = (plotFunc_1plot, plotFunc_2plot)
+	return R_PLOT_FUNCS
+
+
+def render_hmw_r(m1, chr_list, outpre):
+	(plotFunc_1plot, plotFunc_2plot) = r_plot_funcs()
+	import rpy2.robjects as robj
+
 	# if there is one chromosome, plot like this:
 
 	if len(chr_list)==1:
+		chr_val = str(chr_list[0])
    
-		robj.pandas2ri.activate()
 		m1_r = robj.conversion.py2ri(m1)
 	
 		plotFunc_1plot(m1_r,chr_val,outpre)
@@ -238,12 +256,90 @@ def plot_hmw(outpre='out',**kwargs):
 	# if there are 2 chromosomes, plot like this:
 
 	if len(chr_list)==2:
+		chr_val1 = str(chr_list[0])
+		chr_val2 = str(chr_list[1])
 	
 		m1_1 = m1.loc[m1['chrom']==chr_val1]
 		m1_2 = m1.loc[m1['chrom']==chr_val2]
 		
-		robj.pandas2ri.activate()
 		m1_1_r = robj.conversion.py2ri(m1_1)
 		m1_2_r = robj.conversion.py2ri(m1_2)
 	
 		plotFunc_2plot(m1_1_r,m1_2_r,chr_val1,chr_val2,outpre)
+
+
+## matplotlib version of the ggplot2 layout above: 15 x 4.5 in at 100 dpi, one panel per chromosome
+## (widths 1.1:1), x in Mb with 5 breaks from the rounded window range, y breaks every
+## ceiling(label_y/5 / 10)*10 barcodes up to label_y = ceiling(max/20)*20, 5% axis expansion as in ggplot2
+## with raster, the points of a panel are counted in a fixed grid of about one cell per pixel (np.histogram2d) and drawn
+## as one image, so drawing takes the same time whatever the number of windows and barcodes
+
+RASTER_SIZE = (1400, 340)
+
+def expand_range(lo, hi):
+	if hi==lo:
+		return (lo - 0.5, hi + 0.5)
+	return (lo - 0.05*(hi - lo), hi + 0.05*(hi - lo))
+
+def seq_breaks(lo, hi, by):
+	if by<=0:
+		return [lo]
+	return list(np.arange(lo, hi + by*1e-9, by))
+
+def hmw_panel(ax, df, label_x, label_y, y_brk, show_y, raster_bins=None):
+	x_low = df['window_start'].min()/1000000.0
+	x_hi = df['window_end'].max()/1000000.0
+	label_low = np.round(df['window_start'].min()/1000.0)*1000/1000000.0
+	label_hi = np.round(df['window_end'].max()/1000.0)*1000/1000000.0
+
+	xlim = expand_range(x_low, x_hi)
+	ylim = expand_range(df['value'].min(), df['value'].max())
+
+	if raster_bins is None:
+		ax.scatter(df['window_start'].values/1000000.0, df['value'].values, s=6, c='black', marker='o', linewidths=0)
+	else:
+		(grid, x_edges, y_edges) = np.histogram2d(df['window_start'].values/1000000.0, df['value'].values, bins=raster_bins, range=[xlim, ylim])
+		ax.imshow(np.log1p(grid.T), origin='lower', extent=(xlim[0], xlim[1], ylim[0], ylim[1]), aspect='auto', cmap='Greys', vmin=0, interpolation='nearest')
+
+	ax.set_xlim(xlim)
+	ax.set_ylim(ylim)
+	ax.set_xticks([b for b in seq_breaks(label_low, label_hi, (label_hi - label_low)/4) if x_low <= b <= x_hi])
+	ax.set_yticks([b for b in seq_breaks(0, label_y, y_brk) if ylim[0] <= b <= ylim[1]])
+	ax.ticklabel_format(axis='x', style='plain', useOffset=False)
+
+	ax.set_xlabel(str(label_x) + " (Mb)", fontsize=25)
+	ax.tick_params(axis='x', labelsize=20)
+	if show_y:
+		ax.set_ylabel("SV-spanning barcodes", fontsize=25)
+		ax.tick_params(axis='y', labelsize=20)
+	else:
+		ax.tick_params(axis='y', labelleft=False)
+	for spine in ax.spines.values():
+		spine.set_linewidth(2)
+
+def render_hmw_matplotlib(m1, chr_list, outpre, raster=False):
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+	from matplotlib.gridspec import GridSpec
+
+	fig = Figure(figsize=(15,4.5))
+	FigureCanvasAgg(fig)
+
+	if len(chr_list)==1:
+		label_y = math.ceil(m1['value'].max()/20.0)*20
+		y_brk = math.ceil((label_y/5)/10.0)*10
+		hmw_panel(fig.add_subplot(1,1,1), m1, str(chr_list[0]), label_y, y_brk, True, RASTER_SIZE if raster else None)
+
+	if len(chr_list)==2:
+		m1_1 = m1.loc[m1['chrom']==chr_list[0]]
+		m1_2 = m1.loc[m1['chrom']==chr_list[1]]
+		label_y = max(math.ceil(m1_1['value'].max()/20.0)*20, math.ceil(m1_2['value'].max()/20.0)*20)
+		y_brk = math.ceil((label_y/5)/10.0)*10
+		grid = GridSpec(1, 2, width_ratios=[1.1,1])
+		bins_1 = (int(RASTER_SIZE[0]*1.1/2.1), RASTER_SIZE[1]) if raster else None
+		bins_2 = (int(RASTER_SIZE[0]*1.0/2.1), RASTER_SIZE[1]) if raster else None
+		hmw_panel(fig.add_subplot(grid[0]), m1_1, str(chr_list[0]), label_y, y_brk, True, bins_1)
+		hmw_panel(fig.add_subplot(grid[1]), m1_2, str(chr_list[1]), label_y, y_brk, False, bins_2)
+
+	fig.tight_layout()
+	fig.savefig(outpre, dpi=100)
@@ -3,9 +3,12 @@
 import sys
 import pandas as pd
 import math
-import rpy2.robjects as robj
-import rpy2.robjects.pandas2ri # for dataframe conversion
-from rpy2.robjects.packages import importr
+
+from gemtools.phase_tables import load_tables, read_bed_regions, parse_region, region_axis_name, region_vars, region_blocks
+from gemtools.plot_batch import read_plot_manifest, render_plots
+
+## the compiled R plot function (see r_plot_func)
+R_PLOT_FUNC = None
 
 def split_alleles(g):
 	if "|" in g:
@@ -20,7 +23,7 @@ def split_alleles(g):
 	return [a1,a2]
 
 
-def plot_vars_and_blocks(**kwargs):
+def plot_vars_and_blocks(nprocs=1,manifest='None',bed='None',**kwargs):
 
 	if 'infile_basic' in kwargs:
 		infile_basic = kwargs['infile_basic']
@@ -30,45 +33,67 @@ def plot_vars_and_blocks(**kwargs):
 		region = kwargs['region']
 	if 'out' in kwargs:
 		plot_file_name = kwargs['out']
+	if 'nprocs' in kwargs:
+		nprocs = kwargs['nprocs']
+	if 'manifest' in kwargs:
+		manifest = kwargs['manifest']
+	if 'bed' in kwargs:
+		bed = kwargs['bed']
+
+	if str(manifest)!="None":
+		# batch mode: one (region, output png) per manifest row; the tables are read once for all of them
+		load_tables(infile_basic, infile_blocks)
+		jobs = [(infile_basic, infile_blocks, row[0], row[1]) for row in read_plot_manifest(manifest, 2)]
+		render_plots(render_vars_and_blocks, jobs, nprocs, r_plot_func)
+	elif str(bed)!="None":
+		# multi-region mode: one plot per bed region, named after the region (see read_bed_regions)
+		load_tables(infile_basic, infile_blocks)
+		jobs = [(infile_basic, infile_blocks, region, out) for (region, out) in read_bed_regions(bed, plot_file_name)]
+		render_plots(render_vars_and_blocks, jobs, nprocs, r_plot_func)
+	else:
+		render_vars_and_blocks(infile_basic, infile_blocks, region, plot_file_name)
 
 
-	df_basic = pd.read_table(infile_basic, sep="\t")
-	df_blocks = pd.read_table(infile_blocks, sep="\t")
-	chr = str(region.split(",")[0])
-	start = int(region.split(",")[1])
-	stop = int(region.split(",")[2])
+def render_vars_and_blocks(infile_basic, infile_blocks, region, plot_file_name):
+
+	(chr, start, stop) = parse_region(region)
 
 	#start = int( math.floor(start_input / 100000.0) * 1000000.0 )
 	#stop = int( math.ceil(stop_input / 1000000.0) * 1000000.0 )
 
 	# get het SNVs in region (that pass filter)
-	df_basic[['#chrom']] = df_basic[['#chrom']].astype(str)
-	df_basic[['pos']] = df_basic[['pos']].astype(int)
-	df_basic = df_basic[(df_basic['#chrom']==chr) & (df_basic['pos']>start) & (df_basic['pos']<stop) & (df_basic['var_type']=="snv") & (df_basic['filter']=="[]")]
+	df_basic = region_vars(infile_basic, chr, start, stop)
 	df_basic['a1'] = df_basic['gt'].apply(lambda x: split_alleles(x)[0])
 	df_basic['a2'] = df_basic['gt'].apply(lambda x: split_alleles(x)[1])
 	df_basic = df_basic.loc[df_basic['a1']!=df_basic['a2']]
-	df_basic.rename(index=str, columns={"#chrom": "chrom"}, inplace=True)
 	#df_basic.to_csv('basic.txt', sep="\t", index=False)
 
 	# get phase blocks in region
-	df_blocks[['chr']] = df_blocks[['chr']].astype(str)
-	df_blocks[['beg_pos','end_pos']] = df_blocks[['beg_pos','end_pos']].astype(int)
-	df_blocks = df_blocks.loc[(df_blocks['phased_het']>0) & (df_blocks['chr']==chr) & ( ((df_blocks['beg_pos']<start) & (df_blocks['end_pos']>stop)) | ((df_blocks['beg_pos']>start) & (df_blocks['beg_pos']<stop)) | ((df_blocks['end_pos']>start) & (df_blocks['end_pos']<stop)) )]
-	df_blocks['beg_pos_check'] = df_blocks['beg_pos'].apply(lambda x: max(x,start))
-	df_blocks['end_pos_check'] = df_blocks['end_pos'].apply(lambda x: min(x,stop)) 
+	df_blocks = region_blocks(infile_blocks, chr, start, stop)
 	#df_blocks.to_csv('blocks.txt', sep="\t", index=False)
 
 	# make variables for file name and x axis (to pass to R plotting function)
 	#plot_file_name = str(infile_basic.split(".")[0]) + ".vars_blocks.png"
-
-	if chr.startswith("chr"):
-		x_axis_name = chr + " coordinate (Mb)"
-	else:
-		x_axis_name = "chr" + chr + " coordinate (Mb)"
+	x_axis_name = region_axis_name(chr)
 
 	# now ready to plot
-	plotFunc_blockvars = robj.r("""
+	plotFunc_blockvars = r_plot_func()
+	import rpy2.robjects as robj
+
+	df1 = robj.conversion.py2ri(df_basic)
+	df2 = robj.conversion.py2ri(df_blocks)
+
+	plotFunc_blockvars(df1,df2,start,stop,x_axis_name,plot_file_name)
+
+
+def r_plot_func():
+	# R is started and the plot function compiled once per process, and reused by every plot of a batch
+	global R_PLOT_FUNC
+	if R_PLOT_FUNC is None:
+		import rpy2.robjects as robj
+		import rpy2.robjects.pandas2ri # for dataframe conversion
+		robj.pandas2ri.activate()
+		R_PLOT_FUNC = robj.r("""
 		function(df_var,df_blk,b,e,xname,outplot)	{
 			x_min = b/1000000
 			x_max = e/1000000
@@ -106,10 +131,5 @@ def plot_vars_and_blocks(**kwargs):
 
 			dev.off()
 		}
-	""")
-
-	robj.pandas2ri.activate()
-	df1 = robj.conversion.py2ri(df_basic)
-	df2 = robj.conversion.py2ri(df_blocks)
-
-	plotFunc_blockvars(df1,df2,start,stop,x_axis_name,plot_file_name)
+		""")
+	return R_PLOT_FUNC
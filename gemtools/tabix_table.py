@@ -0,0 +1,36 @@
+import os
+import gzip
+from StringIO import StringIO
+import pandas as pd
+import pysam
+
+## HELPERS FOR BGZIP-COMPRESSED, TABIX-INDEXED TABLES (the first line of the table is the header)
+
+def is_tabix_table(infile):
+	return str(infile).endswith(".gz") and os.path.isfile(str(infile) + ".tbi")
+
+def write_tabix_table(df, outfile, seq_col, start_col, end_col):
+	# rows must already be grouped by chromosome and sorted by start
+	tmp_file = str(outfile) + ".tmp"
+	df.to_csv(tmp_file, sep="\t", index=False)
+	pysam.tabix_compress(tmp_file, str(outfile), force=True)
+	os.remove(tmp_file)
+	pysam.tabix_index(str(outfile), force=True, seq_col=seq_col, start_col=start_col, end_col=end_col, line_skip=1, zerobased=False)
+
+def read_tabix_header(infile):
+	with gzip.open(str(infile)) as f:
+		return f.readline().rstrip("\n").split("\t")
+
+def fetch_region_table(infile, chrom, start, stop, dtype=None):
+	# rows overlapping chrom:start-stop, read through the tabix index
+	header = read_tabix_header(infile)
+	tbx = pysam.TabixFile(str(infile))
+	if str(chrom) in tbx.contigs:
+		rows = list(tbx.fetch(str(chrom), max(0,int(start)), int(stop)))
+	else:
+		rows = []
+	tbx.close()
+
+	if not rows:
+		return pd.DataFrame(columns=header)
+	return pd.read_csv(StringIO("\n".join(rows)), sep="\t", header=None, names=header, dtype=dtype)
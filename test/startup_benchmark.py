@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""
+Startup cost of the gemtools CLI, per sub-tool.
+For each tool, a fresh interpreter imports gemtools.__main__ and loads the tool (as 'gemtools -T <tool>' does before
+running it); the best of --repeats wall-clock times and the number of modules loaded are reported. The 'all tools' row
+loads every tool, which is what every gemtools command paid when all tool modules were imported at startup.
+Usage:
+    python test/startup_benchmark.py [--repeats 5] [--python python]
+"""
+
+import os
+import sys
+import argparse
+import subprocess
+
+PROBE = """
+import sys, time
+t = time.time()
+import gemtools.__main__ as gt
+for tool in sys.argv[1:]:
+	gt.load_tool(tool)
+print("%f\\t%d" % (time.time() - t, len(sys.modules)))
+"""
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def time_tools(python, tools, repeats):
+	# best of repeats, or the error message when a tool's dependencies are not installed
+	env = dict(os.environ)
+	env["PYTHONPATH"] = os.pathsep.join([REPO_DIR] + [p for p in [env.get("PYTHONPATH")] if p])
+	times = []
+	for r in xrange(repeats):
+		p = subprocess.Popen([python, "-c", PROBE] + tools, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+		(out, err) = p.communicate()
+		if p.returncode!=0:
+			return (None, None, err.strip().split("\n")[-1])
+		(t, num_modules) = out.strip().split("\t")
+		times.append(float(t))
+	return (min(times), int(num_modules), None)
+
+def main():
+	parser = argparse.ArgumentParser(description='Startup time of gemtools sub-tools.')
+	parser.add_argument("--repeats", default=5, type=int)
+	parser.add_argument("--python", default=sys.executable)
+	args = parser.parse_args()
+
+	sys.path.insert(0, REPO_DIR)
+	from gemtools.__main__ import TOOLS
+
+	print "tool\tstartup_seconds\tmodules_loaded"
+	rows = [("(none)", [])] + [(tool, [tool]) for tool in sorted(TOOLS)] + [("all tools", sorted(TOOLS))]
+	for (name, tools) in rows:
+		(t, num_modules, err) = time_tools(args.python, tools, args.repeats)
+		if err is not None:
+			print "%s\tNA\tNA\t%s" % (name, err)
+		else:
+			print "%s\t%.3f\t%d" % (name, t, num_modules)
+
+if __name__ == '__main__':
+	main()
@@ -28,6 +28,12 @@ echo "Testing count_bcs..."
 gemtools -T count_bcs -i $SV_FILE -e svs.shared.txt -b $BAM_FILE -x 10000 -y 300000 -s call_2080 -o svs.bc_count.txt
 echo "Testing plot_hmw..."
 gemtools -T plot_hmw -i svs.bc_count.txt -o call_2080.png
+echo "Testing get_hmw_summary..."
+gemtools -T get_hmw_summary -i svs.bc_count.txt -o svs.hmw_summary.txt
+echo "Testing count_bcs (long format)..."
+gemtools -T count_bcs -i $SV_FILE -e svs.shared.txt -b $BAM_FILE -x 10000 -y 300000 -s call_2080 -o svs.bc_count_long.txt --long
+echo "Testing plot_hmw (long format)..."
+gemtools -T plot_hmw -i svs.bc_count_long.txt -o call_2080_long.png
 
 # Assign haps with select_barcodes -- better than before, with shared barcodes!
 echo "Testing set_hap_window..."
@@ -41,6 +47,10 @@ echo "Testing get_phased_basic..."
 gemtools -T get_phased_basic -v $VCF_FILE -o phased_basic.txt
 echo "Testing get_phase_blocks..."
 gemtools -T get_phase_blocks -i phased_basic.txt -o phase_blocks.txt
+echo "Testing index_phased_bcs..."
+gemtools -T index_phased_bcs -v $VCF_FILE -o phased_bcs_index
+echo "Testing haplotag..."
+gemtools -T haplotag -b $BAM_FILE -i phased_bcs_index -o haplotagged.bam --nprocs 2
 
 # General tools
 echo "Testing get_phased_bcs..."
@@ -58,5 +68,12 @@ gemtools -T count_bcs_list -b $BAM_FILE -f chr9,128200000,128300000 -x 1000 -l b
 # Subset fastq's
 echo "Testing extract_reads_interleaved..."
 gemtools -T extract_reads_interleaved --bc_list test_files/call_189_bcs.txt --fqdir test_files/fastq_subset --sample_bcs ACGACATT,CACGTCGG,GTATGTCA,TGTCAGAC --lanes 1,2 --outdir fastq_call_189
+echo "Testing extract_reads_bam..."
+gemtools -T extract_reads_bam -b $BAM_FILE --bc_list test_files/call_189_bcs.txt --outdir fastq_call_189_bam
+echo "Testing extract_reads (demultiplexing with --manifest, no --bc_list)..."
+RA_FILE="test_files/fastq_subset/read-RA_si-ACGACATT_lane-001-chunk-0002.fastq.gz"
+zcat $RA_FILE | paste - - - - - - - - | cut -f1-4 | tr '\t' '\n' | gzip > subset_R1.fastq.gz
+zcat $RA_FILE | paste - - - - - - - - | cut -f5-8 | tr '\t' '\n' | gzip > subset_R2.fastq.gz
+gemtools -T extract_reads --manifest svs.shared.txt --read1 subset_R1.fastq.gz --read2 subset_R2.fastq.gz --index1 test_files/fastq_subset/read-I1_si-ACGACATT_lane-001-chunk-0002.fastq.gz --outdir fastq_svs_sets
 
 echo "Testing complete!"